@@ -0,0 +1,65 @@
+import os, sys
+import json
+import time
+import argparse
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bldownloader import extract_playinfo
+
+
+def make_page(episodes=1, filler_kb=600):
+    """构造与视频页结构相近的 HTML：head 中的 __playinfo__ 脚本加上大量正文"""
+    stream = lambda i: {
+        'id': 80, 'baseUrl': f'https://upos-sz-mirror.bilivideo.com/{i}.m4s?deadline=1700000000&sign=abc',
+        'backupUrl': [f'https://upos-hz-mirror.bilivideo.com/{i}.m4s'], 'codecs': 'avc1.640032',
+        'SegmentBase': {'Initialization': '0-1000', 'indexRange': '1001-5000'},
+    }
+    playinfo = {'code': 0, 'data': {'dash': {
+        'video': [stream(i) for i in range(episodes * 8)],
+        'audio': [stream(i) for i in range(episodes * 3)],
+    }}}
+    filler = '<div class="item"><span>bilibili</span><a href="/video/x">link</a></div>\n' * (filler_kb * 1024 // 70)
+    return (
+        '<!DOCTYPE html><html><head itemprop="video">'
+        '<script>window.__INITIAL_STATE__={"aid":1}</script>'
+        f'<script>window.__playinfo__={json.dumps(playinfo)}</script>'
+        f'</head><body>{filler}</body></html>'
+    )
+
+
+def extract_playinfo_lxml(html):
+    # 原先的解析路径：构建 DOM 后用 XPath 找到脚本
+    tree = etree.HTML(html)
+    text = [s for s in tree.xpath('//head[@itemprop="video"]/script/text()') if 'window.__playinfo__' in s][0].replace('window.__playinfo__=', '')
+    return json.loads(text)
+
+
+def bench(func, html, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(html)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare playinfo extraction paths.")
+    parser.add_argument("--rounds", "-n", type=int, default=50, help="Iterations per extractor.")
+    parser.add_argument("--filler_kb", type=int, default=600, help="Approximate size of the page body in KB.")
+    args = parser.parse_args()
+
+    html = make_page(filler_kb=args.filler_kb)
+    assert extract_playinfo(html) == extract_playinfo_lxml(html)
+    lxml_time = bench(extract_playinfo_lxml, html, args.rounds)
+    fast_time = bench(extract_playinfo, html, args.rounds)
+    print(json.dumps({
+        'page_bytes': len(html.encode('utf-8')),
+        'rounds': args.rounds,
+        'lxml_ms': round(lxml_time * 1000, 3),
+        'fast_ms': round(fast_time * 1000, 3),
+        'speedup': round(lxml_time / fast_time, 1),
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
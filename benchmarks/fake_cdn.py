@@ -0,0 +1,249 @@
+import re
+import json
+import struct
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class TokenBucket():
+    """全部连接共享的带宽上限"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class FakeCDN():
+    """模拟 pagelist、视频页 __playinfo__ 和支持 Range 的媒体地址"""
+    BLOCK = 64*1024
+
+    def __init__(self, episodes=4, video_size=32*1024*1024, audio_size=4*1024*1024, bandwidth=0, conn_rate=0,
+                 latency=0, error_rate=0, reset_rate=0, mirrors=2, video_file=None, audio_file=None, seed=0, url_ttl=0):
+        self.episodes = episodes
+        self.bucket = TokenBucket(bandwidth)
+        self.conn_rate = conn_rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.mirrors = mirrors
+        # 大于 0 时媒体地址带 deadline 签名，过期后返回 403，用于模拟长队列中的地址失效
+        self.url_ttl = url_ttl
+        rng = random.Random(seed)
+        # 可以提供真实的媒体文件，使 download_bvid 的合并阶段也能成功
+        self.media = {
+            'video': open(video_file, 'rb').read() if video_file else rng.randbytes(video_size),
+            'audio': open(audio_file, 'rb').read() if audio_file else rng.randbytes(audio_size),
+        }
+        # 真实的 DASH 文件含 sidx 时，playinfo 同 B 站一样给出 SegmentBase
+        self.segment_base = {kind: self.find_segment_base(data) for kind, data in self.media.items()}
+        self.stats = {'requests': 0, 'errors': 0, 'resets': 0, 'expired': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self.server = None
+
+    @staticmethod
+    def find_segment_base(data):
+        pos = 0
+        while pos + 8 <= len(data):
+            size, box_type = struct.unpack_from('>I4s', data, pos)
+            if size < 8:
+                return None
+            if box_type == b'sidx':
+                return {'Initialization': f'0-{pos - 1}', 'indexRange': f'{pos}-{pos + size - 1}'}
+            pos += size
+        return None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def mirror_urls(self, path):
+        # 不同的主机名指向同一服务，用于模拟 baseUrl 与 backupUrl
+        port = self.server.server_address[1]
+        hosts = ['127.0.0.1', 'localhost'][:max(1, self.mirrors)]
+        query = f"?deadline={int(time.time() + self.url_ttl)}" if self.url_ttl else ''
+        return [f"http://{host}:{port}{path}{query}" for host in hosts]
+
+    def playinfo(self, bvid, page):
+        def stream(kind, stream_id):
+            urls = self.mirror_urls(f"/media/{bvid}/{page}/{kind}.m4s")
+            info = {'id': stream_id, 'baseUrl': urls[0], 'backupUrl': urls[1:], 'codecs': 'avc1.640032' if kind == 'video' else 'mp4a.40.2'}
+            if self.segment_base[kind]:
+                info['SegmentBase'] = self.segment_base[kind]
+            return info
+        return {'code': 0, 'data': {'dash': {'video': [stream('video', 80)], 'audio': [stream('audio', 30280)]}}}
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def start(self, host='127.0.0.1', port=0):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def media(self):
+                match = re.match(r'^/media/[^/]+/\d+/(video|audio)\.m4s$', urlparse(self.path).path)
+                return cdn.media[match.group(1)] if match else None
+
+            def inject_error(self):
+                deadline = parse_qs(urlparse(self.path).query).get('deadline')
+                if cdn.url_ttl and (not deadline or int(deadline[0]) < time.time()):
+                    cdn.count('expired')
+                    self.send_response(403)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return True
+                if cdn.error_rate and random.random() < cdn.error_rate:
+                    cdn.count('errors')
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return True
+                return False
+
+            def do_HEAD(self):
+                cdn.count('requests')
+                data = self.media()
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+
+            def do_GET(self):
+                cdn.count('requests')
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+                if url.path == '/x/web-interface/nav':
+                    return self.send_json({'code': 0})
+                if url.path == '/x/player/pagelist':
+                    return self.send_json({'code': 0, 'data': [
+                        {'cid': i + 1, 'page': i + 1, 'part': f'P{i + 1}'} for i in range(cdn.episodes)
+                    ]})
+                if url.path.startswith('/video/'):
+                    bvid = url.path.split('/')[2]
+                    page = int(query.get('p', ['1'])[0])
+                    body = (
+                        '<!DOCTYPE html><html><head itemprop="video">'
+                        f'<script>window.__playinfo__={json.dumps(cdn.playinfo(bvid, page))}</script>'
+                        '</head><body></body></html>'
+                    ).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                data = self.media()
+                if data is None:
+                    self.send_error(404)
+                    return
+                if self.inject_error():
+                    return
+                start, end = 0, len(data) - 1
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), end) if match.group(2) else end
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                else:
+                    self.send_response(200)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                reset_at = None
+                if cdn.reset_rate and random.random() < cdn.reset_rate:
+                    reset_at = random.randint(start, end)
+                try:
+                    pos = start
+                    while pos <= end:
+                        block = data[pos:min(pos + cdn.BLOCK, end + 1)]
+                        if reset_at is not None and pos + len(block) > reset_at:
+                            # 模拟连接中途被 CDN 断开
+                            cdn.count('resets')
+                            self.close_connection = True
+                            return
+                        cdn.bucket.consume(len(block))
+                        if cdn.conn_rate:
+                            time.sleep(len(block) / cdn.conn_rate)
+                        self.wfile.write(block)
+                        cdn.count('bytes', len(block))
+                        pos += len(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def serve(config, ready):
+    """在独立进程中运行，把地址通过 ready 队列发回，避免干扰被测进程的线程数和内存"""
+    cdn = FakeCDN(**config).start()
+    ready.put(cdn.base_url)
+    threading.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Bilibili endpoints.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--episodes", type=int, default=4)
+    parser.add_argument("--bandwidth", type=float, default=0, help="Global cap in bytes/s (0 = unlimited).")
+    parser.add_argument("--conn_rate", type=float, default=0, help="Per-connection cap in bytes/s (0 = unlimited).")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds before each response.")
+    parser.add_argument("--error_rate", type=float, default=0, help="Probability of a 503 per media request.")
+    parser.add_argument("--reset_rate", type=float, default=0, help="Probability of dropping a media response midway.")
+    parser.add_argument("--url_ttl", type=float, default=0, help="Seconds until signed media URLs expire (0 = never).")
+    args = parser.parse_args()
+    cdn = FakeCDN(args.episodes, bandwidth=args.bandwidth, conn_rate=args.conn_rate, latency=args.latency,
+                  error_rate=args.error_rate, reset_rate=args.reset_rate, url_ttl=args.url_ttl).start(port=args.port)
+    print(f"Serving on {cdn.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        cdn.stop()
+
+
+if __name__ == "__main__":
+    main()
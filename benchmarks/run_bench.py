@@ -0,0 +1,175 @@
+import os, sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_cdn import serve
+from bldownloader import MultiThreadDownloader, BLDownloader
+from blmetrics import peak_rss
+
+
+def parse_size(text):
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_list(text, cast=int):
+    return [cast(item) for item in text.split(',') if item]
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # 没有 /proc 时退回峰值 RSS
+        return peak_rss()
+
+
+class Sampler():
+    """后台采样峰值 RSS 和线程数"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, current_rss())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def bytes_transferred(downloader):
+    counters = downloader.metrics.snapshot()['counters']
+    return sum(value for (name, _), value in counters.items() if name == 'bytes_total')
+
+
+def run_target(target, base_url, episodes, workdir, max_workers, segment_size, chunk_size, ffmpeg_path, memory_budget=0):
+    media = lambda page, kind: [f"{base_url}/media/BVbench/{page}/{kind}.m4s"]
+    common = dict(max_workers=max_workers, chunk_size=chunk_size, progress='none', memory_budget=memory_budget)
+    if target == 'download_file':
+        downloader = MultiThreadDownloader(**common)
+        run = lambda: downloader.download_file(media(1, 'video'), workdir, 'video.m4s', True, segment_size) is not None
+    elif target == 'download_files':
+        downloader = MultiThreadDownloader(**common)
+        urls = [media(page, kind) for page in range(1, episodes + 1) for kind in ('video', 'audio')]
+        names = [f"{page}_{kind}.m4s" for page in range(1, episodes + 1) for kind in ('video', 'audio')]
+        run = lambda: all(downloader.download_files(urls, workdir, names, True, segment_size))
+    elif target == 'download_bvid':
+        downloader = BLDownloader(**common, ffmpeg_path=ffmpeg_path, meta_cache=False)
+        downloader.CID_URL = base_url + '/x/player/pagelist?bvid={}'
+        downloader.VIDEO_URL = base_url + '/video/{}?p={}'
+        run = lambda: downloader.download_bvid('BVbench', save_path=workdir, use_segments=True, segment_size=segment_size, cache=False)
+    else:
+        raise ValueError(f"Unknown target: {target}")
+
+    with Sampler() as sampler:
+        start = time.perf_counter()
+        ok = run()
+        seconds = time.perf_counter() - start
+    nbytes = bytes_transferred(downloader)
+    segments = downloader.metrics.snapshot()['summaries'].get(('segment_seconds', ()), {})
+    return {
+        'target': target,
+        'max_workers': max_workers,
+        'segment_size': segment_size,
+        'chunk_size': chunk_size,
+        'memory_budget': memory_budget,
+        'ok': bool(ok),
+        'seconds': round(seconds, 3),
+        'bytes': nbytes,
+        'throughput_mb_s': round(nbytes / seconds / 1024 / 1024, 2) if seconds > 0 else 0,
+        'segment_p50_s': round(segments.get('p50', 0), 4),
+        'segment_p99_s': round(segments.get('p99', 0), 4),
+        'segments': segments.get('count', 0),
+        'peak_rss_mb': round(sampler.peak_rss / 1024 / 1024, 1),
+        'peak_threads': sampler.peak_threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the downloader against a local fake CDN.")
+    parser.add_argument("--targets", type=str, default="download_file,download_files,download_bvid")
+    parser.add_argument("--max_workers", type=str, default="4,8", help="Comma-separated grid values.")
+    parser.add_argument("--segment_size", type=str, default="4M,16M", help="Comma-separated grid values.")
+    parser.add_argument("--chunk_size", type=str, default="64K,1M", help="Comma-separated grid values.")
+    parser.add_argument("--memory_budget", type=str, default="0", help="Read buffer budget passed to the downloader (0 = one buffer per worker).")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--episodes", type=int, default=4)
+    parser.add_argument("--video_size", type=str, default="32M")
+    parser.add_argument("--audio_size", type=str, default="4M")
+    parser.add_argument("--video_file", type=str, default=None, help="Serve a real video stream so merges succeed.")
+    parser.add_argument("--audio_file", type=str, default=None, help="Serve a real audio stream so merges succeed.")
+    parser.add_argument("--bandwidth", type=str, default="0", help="Global server cap per second (0 = unlimited).")
+    parser.add_argument("--conn_rate", type=str, default="0", help="Per-connection server cap per second (0 = unlimited).")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error_rate", type=float, default=0)
+    parser.add_argument("--reset_rate", type=float, default=0)
+    parser.add_argument("--url_ttl", type=float, default=0, help="Seconds until signed media URLs expire (0 = never).")
+    parser.add_argument("--ffmpeg_path", type=str, default=None)
+    parser.add_argument("--output", "-o", type=str, default=None, help="Write the JSON report to this file.")
+    args = parser.parse_args()
+
+    config = dict(
+        episodes=args.episodes, video_size=parse_size(args.video_size), audio_size=parse_size(args.audio_size),
+        bandwidth=parse_size(args.bandwidth), conn_rate=parse_size(args.conn_rate), latency=args.latency,
+        error_rate=args.error_rate, reset_rate=args.reset_rate, video_file=args.video_file, audio_file=args.audio_file,
+        url_ttl=args.url_ttl,
+    )
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(config, ready), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=60)
+
+    # BLDownloader 会在当前目录下创建 data/，在临时目录中运行以免污染仓库
+    root = tempfile.mkdtemp(prefix='blbench_')
+    cwd = os.getcwd()
+    os.chdir(root)
+    results = []
+    try:
+        grid = itertools.product(
+            args.targets.split(','), parse_list(args.max_workers),
+            parse_list(args.segment_size, parse_size), parse_list(args.chunk_size, parse_size),
+        )
+        for target, max_workers, segment_size, chunk_size in grid:
+            for _ in range(args.repeat):
+                workdir = tempfile.mkdtemp(dir=root)
+                result = run_target(target, base_url, args.episodes, workdir, max_workers, segment_size, chunk_size, args.ffmpeg_path, parse_size(args.memory_budget))
+                shutil.rmtree(workdir, ignore_errors=True)
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+        server.terminate()
+
+    report = json.dumps({'server': {k: v for k, v in config.items() if v is not None}, 'results': results}, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
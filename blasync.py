@@ -0,0 +1,176 @@
+import asyncio
+import os
+import time
+from urllib.parse import urlparse
+from bljournal import BLJournal
+from bllimit import BLBandwidthLimiter
+from blmetrics import BLProgress
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncDownloader:
+    """与 MultiThreadDownloader 接口一致的 asyncio 下载后端，单事件循环内限制并发分段请求数"""
+    JOURNAL_CHECKPOINT = 8*1024*1024
+
+    def __init__(self, max_workers=5, chunk_size=1024*1024, timeout=30, retry=3, headers=None, max_inflight=None, limiter=None, progress='tqdm'):
+        if aiohttp is None:
+            raise ImportError("The async engine requires aiohttp: pip install aiohttp")
+        self.max_workers = max_workers
+        self.max_inflight = max_inflight if max_inflight else max_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retry = retry
+        self.progress = progress
+        # 与线程后端共用同一个限速器，每个数据块都从共享令牌桶中扣除
+        self.limiter = limiter if limiter is not None else BLBandwidthLimiter()
+        if headers != None:
+            self.headers = dict(headers)
+        else:
+            self.headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
+                'referer': 'https://www.bilibili.com'
+            }
+
+    def download_file(self, url, save_path=None, file_name=None, use_segments=True, segment_size=10*1024*1024, job=None):
+        return asyncio.run(self._run([url], save_path, [file_name], use_segments, segment_size, job))[0]
+
+    def download_files(self, urls, save_path=None, file_names=None, use_segments=False, segment_size=10*1024*1024, job=None):
+        if file_names != None:
+            if len(urls) != len(file_names):
+                raise ValueError("URLs and file names must have the same length.")
+        else:
+            file_names = [None] * len(urls)
+        return asyncio.run(self._run(urls, save_path, file_names, use_segments, segment_size, job))
+
+    async def _throttle(self, n, job, url):
+        # 令牌不足时只挂起当前协程，不阻塞事件循环
+        wait = self.limiter.reserve(n, job, urlparse(url).netloc)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _run(self, urls, save_path, file_names, use_segments, segment_size, job=None):
+        if save_path is None:
+            save_path = os.getcwd()
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        timeout = aiohttp.ClientTimeout(total=None, connect=self.timeout, sock_read=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.max_inflight)
+        # 所有文件的所有分段共享同一个信号量，限制同时在途的请求数
+        semaphore = asyncio.Semaphore(self.max_inflight)
+        async with aiohttp.ClientSession(headers=self.headers, timeout=timeout, connector=connector) as http:
+            tasks = [
+                self._download_file(http, semaphore, url, save_path, file_name, use_segments, segment_size, job)
+                for url, file_name in zip(urls, file_names)
+            ]
+            return await asyncio.gather(*tasks)
+
+    async def _download_file(self, http, semaphore, url, save_path, file_name, use_segments, segment_size, job=None):
+        # 确定文件名
+        if file_name is None:
+            file_name = os.path.basename(urlparse(url).path)
+            if not file_name:
+                file_name = f"download_{int(time.time())}"
+        file_path = os.path.join(save_path, file_name)
+
+        # 检查是否支持断点续传
+        try:
+            async with semaphore:
+                async with http.head(url, allow_redirects=True) as response:
+                    total_size = int(response.headers.get('content-length', 0))
+                    support_range = response.headers.get('accept-ranges') == 'bytes'
+        except Exception as e:
+            print(f"获取文件信息失败: {e}")
+            total_size = 0
+            support_range = False
+
+        if not support_range or total_size <= 0:
+            return await self._direct_download(http, semaphore, url, file_path, job)
+
+        if total_size < segment_size or not use_segments:
+            segment_size = total_size
+
+        journal = BLJournal.open(file_path, total_size)
+        segments = journal.missing(segment_size)
+        with BLProgress(os.path.basename(file_path)[0:20], total_size, initial=journal.done_size(), mode=self.progress) as pbar:
+            results = await asyncio.gather(*[
+                self._download_segment(http, semaphore, url, file_path, start, end, position, pbar, journal, job)
+                for position, (start, end) in enumerate(segments)
+            ])
+        if not all(results):
+            print("部分分段下载失败")
+            return None
+        journal.remove()
+        print(f"文件下载完成: {file_path}")
+        return file_path
+
+    async def _direct_download(self, http, semaphore, url, file_path, job=None):
+        for attempt in range(self.retry + 1):
+            try:
+                async with semaphore:
+                    async with http.get(url) as response:
+                        response.raise_for_status()
+                        total_size = int(response.headers.get('content-length', 0))
+                        journal = BLJournal(file_path, total_size)
+                        await asyncio.to_thread(journal.save)
+                        with open(file_path, 'wb') as f, BLProgress(os.path.basename(file_path)[0:20], total_size, mode=self.progress) as bar:
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                await self._throttle(len(chunk), job, url)
+                                await asyncio.to_thread(f.write, chunk)
+                                bar.update(len(chunk))
+                await asyncio.to_thread(journal.remove)
+                return file_path
+            except Exception as e:
+                if attempt < self.retry:
+                    print(f"下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
+                    await asyncio.sleep(1)
+                else:
+                    print(f"下载失败: {url}, 错误: {e}")
+                    return None
+
+    @staticmethod
+    def _checkpoint(f, journal, start, end):
+        # 先落盘再记入日志，日志中的区间一定已写入磁盘
+        f.flush()
+        os.fsync(f.fileno())
+        if end >= start:
+            journal.mark_done(start, end)
+
+    async def _download_segment(self, http, semaphore, url, file_path, start, end, position, pbar, journal, job=None):
+        pos = start
+        for attempt in range(self.retry + 1):
+            try:
+                async with semaphore:
+                    headers = {'Range': f'bytes={pos}-{end}'}
+                    async with http.get(url, headers=headers) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise IOError(f"服务器未返回分段内容: {response.status}")
+                        with open(file_path, 'r+b') as f:
+                            f.seek(pos)
+                            checkpoint = pos
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                chunk = chunk[:end - pos + 1]
+                                await self._throttle(len(chunk), job, url)
+                                await asyncio.to_thread(f.write, chunk)
+                                pos += len(chunk)
+                                pbar.update(len(chunk))
+                                if pos - checkpoint >= self.JOURNAL_CHECKPOINT:
+                                    await asyncio.to_thread(self._checkpoint, f, journal, checkpoint, pos - 1)
+                                    checkpoint = pos
+                                if pos > end:
+                                    break
+                            await asyncio.to_thread(self._checkpoint, f, journal, checkpoint, pos - 1)
+                if pos != end + 1:
+                    raise IOError(f"分段长度不符: 期望 {end - start + 1}, 实际 {pos - start}")
+                return True
+            except Exception as e:
+                if attempt < self.retry:
+                    print(f"分段 {position} 下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
+                    await asyncio.sleep(1)
+                else:
+                    print(f"分段 {position} 下载失败: {e}")
+                    return False
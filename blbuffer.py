@@ -0,0 +1,57 @@
+import threading
+from contextlib import contextmanager
+
+
+class BLBufferPool():
+    """固定数量、可复用的读缓冲区：总内存不超过 buffer_size * count，用完时借用方阻塞等待"""
+
+    def __init__(self, buffer_size, count):
+        self.buffer_size = buffer_size
+        self.count = max(1, count)
+        self.allocated = 0
+        self.waits = 0
+        self._free = []
+        self._cond = threading.Condition()
+
+    @classmethod
+    def for_budget(cls, buffer_size, memory_budget, default_count, min_count=2):
+        """按内存预算换算缓冲区数量，预算为 0 时每个并发传输一块；预算不足 min_count 块时缩小缓冲区"""
+        if not memory_budget:
+            return cls(buffer_size, max(min_count, default_count))
+        count = max(min_count, memory_budget // buffer_size)
+        return cls(max(1, min(buffer_size, memory_budget // count)), count)
+
+    def acquire(self):
+        with self._cond:
+            if not self._free and self.allocated >= self.count:
+                # 缓冲区耗尽：暂停读取网络数据，直到有传输归还缓冲区
+                self.waits += 1
+                while not self._free and self.allocated >= self.count:
+                    self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            # 按需分配，空闲时不占用全部预算
+            self.allocated += 1
+        return memoryview(bytearray(self.buffer_size))
+
+    def release(self, buffer):
+        with self._cond:
+            self._free.append(buffer)
+            self._cond.notify()
+
+    @contextmanager
+    def buffer(self):
+        buffer = self.acquire()
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'buffers': self.allocated,
+                'capacity': self.count,
+                'bytes': self.allocated * self.buffer_size,
+                'waits': self.waits,
+            }
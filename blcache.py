@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse, parse_qs
+
+
+class BLMetaCache():
+    PAGELIST_TTL = 24*60*60
+    PLAYINFO_TTL = 30*60
+    # 在流地址的 deadline 之前预留的安全时间
+    EXPIRY_MARGIN = 5*60
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS pagelist (bvid TEXT PRIMARY KEY, data TEXT, expires_at REAL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS playinfo (bvid TEXT, cid INTEGER, data TEXT, expires_at REAL, PRIMARY KEY (bvid, cid))')
+
+    def _get(self, query, args):
+        with self._lock:
+            row = self._conn.execute(query, args).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def get_pagelist(self, bvid):
+        return self._get('SELECT data, expires_at FROM pagelist WHERE bvid = ?', (bvid,))
+
+    def put_pagelist(self, bvid, data, ttl=None):
+        expires_at = time.time() + (ttl if ttl else self.PAGELIST_TTL)
+        with self._lock, self._conn:
+            self._conn.execute('REPLACE INTO pagelist VALUES (?, ?, ?)', (bvid, json.dumps(data), expires_at))
+
+    def get_playinfo(self, bvid, cid):
+        return self._get('SELECT data, expires_at FROM playinfo WHERE bvid = ? AND cid = ?', (bvid, cid))
+
+    def put_playinfo(self, bvid, cid, data):
+        expires_at = self.playinfo_expiry(data)
+        with self._lock, self._conn:
+            self._conn.execute('REPLACE INTO playinfo VALUES (?, ?, ?, ?)', (bvid, cid, json.dumps(data), expires_at))
+
+    def invalidate_playinfo(self, bvid, cid):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM playinfo WHERE bvid = ? AND cid = ?', (bvid, cid))
+
+    def playinfo_expiry(self, data):
+        """流地址带签名的 deadline 参数，缓存不能超过其中最早的一个"""
+        expires_at = time.time() + self.PLAYINFO_TTL
+        dash = data.get('data', {}).get('dash', {})
+        for stream in dash.get('video', []) + dash.get('audio', []):
+            deadline = parse_qs(urlparse(stream.get('baseUrl', '')).query).get('deadline')
+            if deadline and deadline[0].isdigit():
+                expires_at = min(expires_at, int(deadline[0]) - self.EXPIRY_MARGIN)
+        return expires_at
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
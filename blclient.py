@@ -0,0 +1,88 @@
+import json
+import socket
+import http.client
+
+# 客户端只依赖标准库，向常驻进程提交任务时无需导入下载相关的模块
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+
+
+def parse_address(address):
+    """'unix:/path/to.sock' 表示 Unix 套接字，否则为 'host:port'"""
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class BLClient():
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=5):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        kind, target = parse_address(self.address)
+        if kind == 'unix':
+            return UnixHTTPConnection(target, timeout=self.timeout)
+        return http.client.HTTPConnection(*target, timeout=self.timeout)
+
+    def _request(self, method, path, body=None):
+        conn = self._connection()
+        try:
+            payload = json.dumps(body).encode('utf-8') if body is not None else None
+            conn.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            data = json.loads(response.read() or b'null')
+        finally:
+            conn.close()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} failed ({response.status}): {data.get('error') if isinstance(data, dict) else data}")
+        return data
+
+    def available(self):
+        try:
+            self._request('GET', '/status')
+            return True
+        except (OSError, RuntimeError, ValueError):
+            return False
+
+    def submit(self, bvids, weight=None, rate=None):
+        body = {'bvids': list(bvids)}
+        if weight is not None:
+            body['weight'] = weight
+        if rate is not None:
+            body['rate'] = rate
+        return self._request('POST', '/jobs', body)
+
+    def update_job(self, bvid, weight=None, rate=None):
+        body = {'weight': weight, 'rate': rate}
+        return self._request('PUT', f'/jobs/{bvid}', {k: v for k, v in body.items() if v is not None})
+
+    def set_limits(self, global_rate=None, host_rate=None):
+        body = {'global_rate': global_rate, 'host_rate': host_rate}
+        return self._request('PUT', '/limits', {k: v for k, v in body.items() if v is not None})
+
+    def job(self, bvid):
+        return self._request('GET', f'/jobs/{bvid}')
+
+    def jobs(self):
+        return self._request('GET', '/jobs')
+
+    def cancel(self, bvid):
+        return self._request('DELETE', f'/jobs/{bvid}')
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def shutdown(self):
+        return self._request('POST', '/shutdown')
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import socketserver
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from blqueue import BLJobQueue
+from blclient import parse_address
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class BLDaemon():
+    """常驻进程：登录会话、连接池和元数据缓存保持可用，通过本地 JSON 接口接收下载任务"""
+
+    def __init__(self, downloader, queue_path, download_path, download_kwargs=None, address='127.0.0.1:8765', settings=None, jobs=1):
+        self.downloader = downloader
+        # 同时执行的任务数，多个任务共用下载器的连接池和限速器，按权重分配总带宽
+        self.jobs = max(1, jobs)
+        self.queue_path = queue_path
+        self.download_path = download_path
+        self.download_kwargs = download_kwargs or {}
+        self.address = address
+        # 任务沿用常驻进程启动时的参数，status 中返回，客户端据此提示被忽略的参数
+        self.settings = {'download_path': os.path.abspath(download_path), **self.download_kwargs, **(settings or {})}
+        self.started = time.time()
+        # sqlite 连接不能跨线程使用，每个线程各自打开队列
+        self._local = threading.local()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self.server = None
+
+    def queue(self):
+        queue = getattr(self._local, 'queue', None)
+        if queue is None:
+            queue = self._local.queue = BLJobQueue(self.queue_path)
+        return queue
+
+    def submit(self, bvids, weight=None, rate=None):
+        # 重新提交已失败或已取消的任务时重新排队
+        self.queue().add(bvids, reset=True, weight=weight, rate=rate)
+        for bvid in bvids:
+            self._apply_limits(bvid, weight, rate)
+        self._wakeup.set()
+        return [self.queue().get(bvid) for bvid in bvids]
+
+    def update_job(self, bvid, weight=None, rate=None):
+        """修改任务的带宽权重或上限，正在执行的任务立即生效；任务不存在时返回 None"""
+        if not self.queue().update_job(bvid, weight, rate):
+            return None
+        self._apply_limits(bvid, weight, rate)
+        return self.queue().get(bvid)
+
+    def _apply_limits(self, bvid, weight, rate):
+        # 未登记的任务由限速器忽略，开始执行时再从队列读取
+        if weight is not None:
+            self.downloader.limiter.set_weight(bvid, weight)
+        if rate is not None:
+            self.downloader.limiter.set_job_rate(bvid, rate)
+
+    def set_limits(self, global_rate=None, host_rate=None):
+        """运行中调整总上限和单主机上限，返回调整后的限速器状态"""
+        limiter = self.downloader.limiter
+        if global_rate is not None:
+            limiter.set_global_rate(global_rate)
+            self.settings['rate_limit'] = global_rate
+        if host_rate is not None:
+            limiter.set_host_rate(host_rate)
+            self.settings['host_rate_limit'] = host_rate
+        return limiter.snapshot()
+
+    def cancel(self, bvid):
+        previous = self.queue().cancel(bvid)
+        if previous is None:
+            return None
+        with self._lock:
+            event = self._running.get(bvid)
+        if event is not None:
+            event.set()
+        return self.queue().get(bvid)
+
+    def status(self):
+        with self._lock:
+            running = list(self._running)
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'running': running,
+            'counts': self.queue().counts(),
+            'pool': self.downloader.pool.stats(),
+            'limiter': self.downloader.limiter.snapshot(),
+            'settings': self.settings,
+        }
+
+    def _process(self, bvid):
+        cancel = threading.Event()
+        with self._lock:
+            self._running[bvid] = cancel
+        queue = self.queue()
+        job = queue.get(bvid) or {}
+        # claim 之后、登记之前到达的取消请求找不到事件，登记后再检查一次状态
+        if job.get('state') == BLJobQueue.CANCELLED:
+            cancel.set()
+
+        def on_stage(state):
+            if not cancel.is_set():
+                queue.set_state(bvid, state)
+        try:
+            # 已取消的任务不再开始下载
+            success = not cancel.is_set() and self.downloader.download_bvid(
+                bvid,
+                save_path=os.path.join(self.download_path, bvid),
+                on_stage=on_stage,
+                cancel=cancel,
+                weight=job.get('weight') or 1,
+                rate=job.get('rate') or 0,
+                **self.download_kwargs
+            )
+            error = None if success else 'download or merge failed'
+        except Exception as e:
+            success, error = False, str(e)
+        finally:
+            with self._lock:
+                self._running.pop(bvid, None)
+        if cancel.is_set():
+            # on_stage 可能在取消的同时写入了进行中的状态，这里重新确认
+            queue.set_state(bvid, BLJobQueue.CANCELLED)
+            self.downloader.logger.info(f"Cancelled {bvid}")
+        elif success:
+            queue.set_state(bvid, BLJobQueue.DONE)
+            self.downloader.logger.info(f"Finished {bvid}")
+        else:
+            state = queue.fail(bvid, error)
+            self.downloader.logger.warning(f"{bvid} failed ({error}), now {state}")
+
+    def _run(self, index):
+        """每个执行线程按提交顺序逐个领取任务，单个任务内部的并发由下载器负责"""
+        queue = self.queue()
+        worker = f"daemon-{os.getpid()}-{index}"
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            bvid = queue.claim(worker)
+            if bvid is None:
+                wakeup = queue.next_wakeup()
+                self._wakeup.wait(min(max(wakeup - time.time(), 0.1), 30) if wakeup else 30)
+                continue
+            self.downloader.logger.info(f"Processing {bvid}")
+            self._process(bvid)
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def address_string(self):
+                return str(self.client_address)
+
+            def send_json(self, status, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_json(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+            def job_path(self):
+                parts = self.path.strip('/').split('/')
+                return parts[1] if len(parts) == 2 and parts[0] == 'jobs' else None
+
+            def do_GET(self):
+                if self.path == '/status':
+                    return self.send_json(200, daemon.status())
+                if self.path == '/jobs':
+                    return self.send_json(200, {'jobs': daemon.queue().list()})
+                bvid = self.job_path()
+                job = daemon.queue().get(bvid) if bvid else None
+                if job is None:
+                    return self.send_json(404, {'error': 'not found'})
+                self.send_json(200, job)
+
+            def do_POST(self):
+                if self.path == '/shutdown':
+                    self.send_json(200, {'ok': True})
+                    threading.Thread(target=daemon.stop, daemon=True).start()
+                    return
+                if self.path != '/jobs':
+                    return self.send_json(404, {'error': 'not found'})
+                try:
+                    data = self.read_json()
+                except ValueError:
+                    return self.send_json(400, {'error': 'invalid JSON'})
+                bvids = data.get('bvids') or ([data['bvid']] if data.get('bvid') else [])
+                if not bvids or not all(isinstance(bvid, str) and bvid for bvid in bvids):
+                    return self.send_json(400, {'error': 'bvid or bvids is required'})
+                limits, error = self.read_limits(data, {'weight': 'weight', 'rate': 'rate'})
+                if error:
+                    return self.send_json(400, {'error': error})
+                self.send_json(202, {'jobs': daemon.submit(bvids, **limits)})
+
+            def read_limits(self, data, fields):
+                """取出非负数值字段，fields 为 JSON 字段到参数名的映射"""
+                limits = {}
+                for field, name in fields.items():
+                    value = data.get(field)
+                    if value is None:
+                        continue
+                    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                        return None, f'{field} must be a non-negative number'
+                    limits[name] = value
+                if limits.get('weight') == 0:
+                    return None, 'weight must be positive'
+                return limits, None
+
+            def do_PUT(self):
+                try:
+                    data = self.read_json()
+                except ValueError:
+                    return self.send_json(400, {'error': 'invalid JSON'})
+                if self.path == '/limits':
+                    limits, error = self.read_limits(data, {'global_rate': 'global_rate', 'host_rate': 'host_rate'})
+                    if error:
+                        return self.send_json(400, {'error': error})
+                    return self.send_json(200, daemon.set_limits(**limits))
+                bvid = self.job_path()
+                if bvid is None:
+                    return self.send_json(404, {'error': 'not found'})
+                limits, error = self.read_limits(data, {'weight': 'weight', 'rate': 'rate'})
+                if error:
+                    return self.send_json(400, {'error': error})
+                job = daemon.update_job(bvid, **limits)
+                if job is None:
+                    return self.send_json(404, {'error': 'not found'})
+                self.send_json(200, job)
+
+            def do_DELETE(self):
+                bvid = self.job_path()
+                if bvid is None or daemon.queue().get(bvid) is None:
+                    return self.send_json(404, {'error': 'not found'})
+                job = daemon.cancel(bvid)
+                if job is None:
+                    return self.send_json(409, {'error': 'job already finished', 'job': daemon.queue().get(bvid)})
+                self.send_json(200, job)
+        return Handler
+
+    def _bind(self):
+        kind, target = parse_address(self.address)
+        if kind == 'unix':
+            # 上次运行遗留的套接字文件
+            if os.path.exists(target):
+                os.remove(target)
+            return ThreadingUnixHTTPServer(target, self._handler())
+        server = ThreadingHTTPServer(target, self._handler())
+        server.daemon_threads = True
+        return server
+
+    def serve(self):
+        """恢复中断的任务，启动执行线程并处理请求，直到 stop 被调用"""
+        self.queue().recover()
+        self.server = self._bind()
+        runners = [threading.Thread(target=self._run, args=(index,), daemon=True) for index in range(self.jobs)]
+        for runner in runners:
+            runner.start()
+        self.downloader.logger.info(f"Daemon listening on {self.address} ({self.jobs} concurrent jobs)")
+        try:
+            self.server.serve_forever()
+        finally:
+            self._stop.set()
+            self._wakeup.set()
+            with self._lock:
+                for event in self._running.values():
+                    event.set()
+            for runner in runners:
+                runner.join()
+            self.server.server_close()
+            kind, target = parse_address(self.address)
+            if kind == 'unix' and os.path.exists(target):
+                os.remove(target)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
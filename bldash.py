@@ -0,0 +1,86 @@
+import struct
+
+
+def parse_range(value):
+    """'first-last' 形式的字节区间，两端都包含在内"""
+    first, _, last = str(value).partition('-')
+    return int(first), int(last)
+
+
+def segment_base(stream):
+    """playinfo 中流的初始化段和 sidx 所在的字节区间，缺失时返回 None"""
+    base = stream.get('SegmentBase') or stream.get('segment_base')
+    if not base:
+        return None
+    init = base.get('Initialization') or base.get('initialization')
+    index = base.get('indexRange') or base.get('index_range')
+    if not init or not index:
+        return None
+    try:
+        return parse_range(init), parse_range(index)
+    except ValueError:
+        return None
+
+
+def parse_time(value):
+    """秒数或 [[时:]分:]秒 形式的时间点"""
+    seconds = 0.0
+    for part in str(value).split(':'):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"negative time: {value}")
+    return seconds
+
+
+def clip_suffix(start, end):
+    return f"_{start:g}-{end:g}s" if end is not None else f"_{start:g}s-end"
+
+
+def parse_sidx(data, offset):
+    """解析 sidx 盒，data 从盒的首字节开始，offset 为其在文件中的位置；
+    返回各分片的 (起始秒, 结束秒, 首字节, 末字节)"""
+    size, box_type = struct.unpack_from('>I4s', data, 0)
+    header = 8
+    if size == 1:
+        size, = struct.unpack_from('>Q', data, 8)
+        header = 16
+    if box_type != b'sidx':
+        raise ValueError(f"expected sidx box, got {box_type!r}")
+    if size > len(data):
+        raise ValueError(f"truncated sidx box: {len(data)} of {size} bytes")
+    version = data[header]
+    pos = header + 4
+    _, timescale = struct.unpack_from('>II', data, pos)
+    pos += 8
+    if version == 0:
+        earliest, first_offset = struct.unpack_from('>II', data, pos)
+        pos += 8
+    else:
+        earliest, first_offset = struct.unpack_from('>QQ', data, pos)
+        pos += 16
+    count, = struct.unpack_from('>2xH', data, pos)
+    pos += 4
+    if not timescale:
+        raise ValueError("sidx timescale is zero")
+    # 分片偏移以 sidx 盒之后的第一个字节为基准
+    byte = offset + size + first_offset
+    time = earliest
+    fragments = []
+    for _ in range(count):
+        reference, duration, _ = struct.unpack_from('>III', data, pos)
+        pos += 12
+        if reference >> 31:
+            raise ValueError("hierarchical sidx is not supported")
+        referenced_size = reference & 0x7fffffff
+        fragments.append((time / timescale, (time + duration) / timescale, byte, byte + referenced_size - 1))
+        time += duration
+        byte += referenced_size
+    return fragments
+
+
+def select_fragments(fragments, start, end=None):
+    """覆盖 [start, end) 的连续分片，返回 (首字节, 末字节, 起始秒, 结束秒)；区间之外返回 None"""
+    chosen = [f for f in fragments if f[1] > start and (end is None or f[0] < end)]
+    if not chosen:
+        return None
+    return chosen[0][2], chosen[-1][3], chosen[0][0], chosen[-1][1]
@@ -4,31 +4,75 @@ import concurrent.futures
 import json
 import os
 import time
+import sqlite3
+import http.client
+import contextlib
 from urllib.parse import urlparse
 from tqdm import tqdm
 import threading
 from blauth import BLAuth
-from lxml import etree
 from blmerge import BLMerger
+from bljournal import BLJournal
+from blasync import AsyncDownloader
+from blscheduler import TransferScheduler, Segment
+from blcache import BLMetaCache
+from blstore import BLMediaStore
+from blhosts import BLHostStats
+from blmetrics import BLMetrics, BLProgress, BLStatsWriter, peak_rss
+from bllimit import BLBandwidthLimiter
+from blhttp import BLConnectionPool
+from blbuffer import BLBufferPool
+from bldash import segment_base, parse_sidx, select_fragments, clip_suffix
+from blretry import BLRetryPolicy, StreamMismatch, EXPIRED, THROTTLED, TRANSIENT, FATAL
+
+
+PLAYINFO_MARKER = 'window.__playinfo__='
+
+
+def extract_playinfo(html):
+    """直接定位 window.__playinfo__ 并解码其后的 JSON，无需构建 DOM"""
+    index = html.find(PLAYINFO_MARKER)
+    if index < 0:
+        raise ValueError("window.__playinfo__ not found in page")
+    playinfo, _ = json.JSONDecoder().raw_decode(html, index + len(PLAYINFO_MARKER))
+    return playinfo
 
 
 class MultiThreadDownloader:
-    def __init__(self, max_workers=5, chunk_size=1024*1024, timeout=30, retry=3, headers=None):
+    JOURNAL_CHECKPOINT = 8*1024*1024
+    MEDIA_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
+        'referer': 'https://www.bilibili.com'
+    }
+
+    def __init__(self, max_workers=5, chunk_size=1024*1024, timeout=30, retry=3, headers=None, adaptive=False, progress='tqdm', limiter=None, memory_budget=0):
         self.max_workers = max_workers
+        # 自适应模式：按实测吞吐调整并发数，空闲线程窃取慢分段的剩余区间
+        self.adaptive = adaptive
         self.chunk_size = chunk_size
+        # 所有传输从同一个缓冲池借用读缓冲区，内存占用不随分段大小和并发数无限增长；
+        # 至少两块，保证直连合并时同一集的音视频可以同时读取
+        self.buffers = BLBufferPool.for_budget(chunk_size, memory_budget, max_workers)
         self.timeout = timeout
         self.retry = retry
-        self.session = requests.Session()
-        if headers != None:
-            self.session.headers.update(headers)
-        else:
-            self.session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
-                'referer': 'https://www.bilibili.com'
-            })
+        # 每个主机保留的连接数与并发数一致，避免超出默认的 10 个后反复重新握手
+        self.pool = BLConnectionPool(max_workers)
+        self.session = self.pool.mount(requests.Session())
+        self.session.headers.update(headers if headers is not None else self.MEDIA_HEADERS)
         self._lock = threading.Lock()
+        self.errors = 0
+        # 错误分类与退避策略；过期的流地址被重新解析后，旧地址映射到新的镜像列表
+        self.retry_policy = BLRetryPolicy()
+        self._url_aliases = {}
+        self.host_stats = BLHostStats()
+        # 进度显示方式: 'tqdm'、'headless'（定时输出一行文本）或 'none'
+        self.progress = progress
+        self.metrics = BLMetrics()
+        # 所有传输共用的限速器，可在多个下载器之间共享
+        self.limiter = limiter if limiter is not None else BLBandwidthLimiter()
     
     def download_file(self, url, save_path=None, file_name=None, use_segments=True, segment_size=10*1024*1024):
+        # url 可以是单个地址，也可以是同一文件的多个镜像地址
         if save_path is None:
             save_path = os.getcwd()
         
@@ -37,113 +81,387 @@ class MultiThreadDownloader:
         
         # 确定文件名
         if file_name is None:
-            file_name = os.path.basename(urlparse(url).path)
+            file_name = os.path.basename(urlparse(self._mirrors(url)[0]).path)
             if not file_name:
                 file_name = f"download_{int(time.time())}"
         
         file_path = os.path.join(save_path, file_name)
         
-        # 检查是否支持断点续传
-        try:
-            response = self.session.head(url, timeout=self.timeout)
-            total_size = int(response.headers.get('content-length', 0))
-            support_range = 'accept-ranges' in response.headers and response.headers['accept-ranges'] == 'bytes'
-        except Exception as e:
-            print(f"获取文件信息失败: {e}")
-            total_size = 0
-            support_range = False
+        if self.adaptive and use_segments:
+            scheduler = TransferScheduler(self, adaptive=True)
+            scheduler.add(url, file_path, segment_size)
+            return file_path if scheduler.run() else None
         
-        # 如果文件太小或不支持断点续传，直接下载
-        if not support_range or total_size < segment_size or not use_segments:
+        total_size, support_range, url = self._probe(url)
+        
+        # 不支持断点续传时只能整体重新下载
+        if not support_range or total_size <= 0:
             return self._direct_download(url, file_path)
         
+        # 文件太小或未启用分段时按单个区间下载，仍可借助日志续传
+        if total_size < segment_size or not use_segments:
+            segment_size = total_size
+        
         # 分段下载
         return self._segmented_download(url, file_path, total_size, segment_size)
     
-    def _direct_download(self, url, file_path):
+    @staticmethod
+    def _mirrors(url):
+        return [url] if isinstance(url, str) else list(url)
+    
+    def _probe_one(self, url):
+        """请求首个字节，检查文件大小以及是否支持断点续传"""
+        with self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code == 206:
+                return int(response.headers.get('content-range', '').rsplit('/', 1)[-1]), True
+            return int(response.headers.get('content-length', 0)), False
+    
+    def _race_mirrors(self, urls):
+        """同时向所有镜像发出首个分段请求，最先成功响应的镜像排在首位"""
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(urls))
+        futures = {executor.submit(self._probe_one, url): url for url in urls}
+        error = None
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                url = futures[future]
+                try:
+                    total_size, support_range = future.result()
+                except Exception as e:
+                    error = e
+                    self._record_probe_error(e, url)
+                    print(f"镜像不可用 {self.host_stats.host(url)}: {e}")
+                    continue
+                others = [u for u in self.host_stats.rank(urls) if u != url]
+                return total_size, support_range, [url] + others
+        finally:
+            executor.shutdown(wait=False)
+        raise IOError("所有镜像均不可用") from error
+    
+    def _probe_mirrors(self, urls):
+        # 没有历史记录时赛跑选出最快响应的镜像，否则直接使用历史吞吐最高的镜像
+        if len(urls) > 1 and not self.host_stats.known(urls):
+            return self._race_mirrors(urls)
+        urls = self.host_stats.rank(urls)
+        for i, candidate in enumerate(urls):
+            try:
+                total_size, support_range = self._probe_one(candidate)
+                return total_size, support_range, urls[i:] + urls[:i]
+            except Exception as e:
+                self._record_probe_error(e, candidate)
+                if i == len(urls) - 1:
+                    raise
+                print(f"镜像不可用 {self.host_stats.host(candidate)}: {e}")
+    
+    def _record_probe_error(self, error, url):
+        # 与 _plan_retry 相同，签名过期不是镜像的问题，不降低其评分
+        if self.retry_policy.classify(error, url) != EXPIRED:
+            self.host_stats.record_error(url)
+    
+    def _probe(self, url):
+        """返回文件大小、是否支持断点续传以及按优先级排序的镜像列表"""
+        urls = self._current_urls(url)
+        try:
+            return self._probe_mirrors(urls)
+        except Exception as e:
+            error = e
+        # 签名过期时重新解析地址后再探测一次
+        fresh = self._refresh_urls(urls) if self.retry_policy.classify(error, urls[0]) == EXPIRED else None
+        if fresh:
+            try:
+                return self._probe_mirrors(fresh)
+            except Exception as e:
+                error, urls = e, fresh
+        print(f"获取文件信息失败: {error}")
+        return 0, False, urls
+    
+    def _current_urls(self, url):
+        """返回镜像列表；地址已被重新解析或即将过期时使用新地址"""
+        urls = self._mirrors(url)
+        urls = self._url_aliases.get(urls[0], urls)
+        if self.retry_policy.expired(urls[0]):
+            urls = self._refresh_urls(urls) or urls
+        return urls
+    
+    def _refresh_urls(self, urls):
+        """流地址过期时返回新的镜像列表；通用下载器无法重新解析地址，返回 None"""
+        return None
+    
+    def _plan_retry(self, error, url, urls, attempt, kind):
+        """对一次传输错误分类，返回重试使用的镜像列表和等待时间；不应重试时返回 (None, None)"""
+        reason = self.retry_policy.classify(error, url)
+        # 地址过期与主机无关，不计入主机评分和自适应并发的错误数
+        if reason != EXPIRED:
+            self.host_stats.record_error(url)
+        if reason in (THROTTLED, TRANSIENT):
+            with self._lock:
+                self.errors += 1
+        self.metrics.add('errors_total', kind=kind, reason=reason, host=self.host_stats.host(url))
+        if reason == FATAL or attempt >= self.retry:
+            return None, None
+        self.metrics.add('retries_total', kind=kind)
+        if reason == EXPIRED:
+            fresh = self._refresh_urls(urls)
+            if fresh:
+                return fresh, 0
+            reason = TRANSIENT
+        return urls, self.retry_policy.delay(attempt, error, reason)
+    
+    def _direct_download(self, url, file_path, job=None, pbar=None):
+        # pbar 由调度器传入时字节计入其总进度和吞吐量，否则单独显示进度
+        urls = self._current_urls(url)
+        counted = False
         for attempt in range(self.retry + 1):
+            # 每次重试切换到下一个镜像
+            url = urls[attempt % len(urls)]
+            written = 0
             try:
-                with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                with self.buffers.buffer() as buffer, self.session.get(url, stream=True, timeout=self.timeout) as response:
                     response.raise_for_status()
                     total_size = int(response.headers.get('content-length', 0))
+                    # 无法续传，但日志存在即表示文件尚不完整
+                    journal = BLJournal(file_path, total_size)
+                    journal.save()
+                    if pbar is not None and not counted:
+                        with self._lock:
+                            pbar.total += total_size
+                        counted = True
                     
-                    with open(file_path, 'wb') as f, tqdm(
-                            desc=os.path.basename(file_path)[0:20],
-                            total=total_size,
-                            unit='B',
-                            unit_scale=True,
-                            unit_divisor=1024,
-                        ) as bar:
-                        for chunk in response.iter_content(chunk_size=self.chunk_size):
-                            if chunk:
-                                f.write(chunk)
-                                bar.update(len(chunk))
+                    progress = contextlib.nullcontext(pbar) if pbar is not None else BLProgress(os.path.basename(file_path)[0:20], total_size, mode=self.progress)
+                    with open(file_path, 'wb') as f, progress as bar:
+                        for chunk in self._read_chunks(response, buffer):
+                            self.limiter.acquire(len(chunk), job, self.host_stats.host(url))
+                            f.write(chunk)
+                            written += len(chunk)
+                            bar.update(len(chunk))
+                    # 长度不符时保留日志，文件不会被当作已完成
+                    if total_size and written != total_size:
+                        raise IOError(f"文件长度不符: 期望 {total_size}, 实际 {written}")
+                self.metrics.add('bytes_total', total_size, host=self.host_stats.host(url))
+                journal.remove()
                 return file_path
             except Exception as e:
-                if attempt < self.retry:
-                    print(f"下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
-                    time.sleep(1)
-                else:
+                if pbar is not None:
+                    # 无法续传，重试从头写入，撤回本次已计入的进度
+                    pbar.update(-written)
+                retry_urls, delay = self._plan_retry(e, url, urls, attempt, 'direct')
+                if retry_urls is None:
                     print(f"下载失败: {url}, 错误: {e}")
                     return None
+                print(f"下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
+                urls = retry_urls
+                time.sleep(delay)
     
-    def _download_segment(self, url, file_path, start, end, position, pbar):
-        temp_file = f"{file_path}.part{position}"
-        headers = {'Range': f'bytes={start}-{end}'}
+    def _download_segment(self, url, file_path, start, end, position, pbar, journal, segment=None, job=None, shift=0, source_size=None):
+        # segment.end 可能在下载过程中被其他线程缩短（工作窃取）
+        # 只下载片段时，本地偏移加上 shift 才是远端文件中的偏移，source_size 为远端文件大小
+        if segment is None:
+            segment = Segment(start, end)
+        urls = self._current_urls(url)
+        pos = start
         
         for attempt in range(self.retry + 1):
+            # 每次重试切换到下一个镜像
+            url = urls[attempt % len(urls)]
+            attempt_start, attempt_time = pos, time.time()
+            # 分段已被窃取或取消截断到当前位置
+            if pos > segment.end:
+                return True, position
             try:
-                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                # 重试时从已落盘的位置继续，而不是从分段起点重新下载
+                headers = {'Range': f'bytes={pos + shift}-{segment.end + shift}'}
+                # 先借到缓冲区再发起请求，缓冲池耗尽时不会占着连接空等
+                with self.buffers.buffer() as buffer, self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
                     response.raise_for_status()
-                    with open(temp_file, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=self.chunk_size):
-                            if chunk:
-                                f.write(chunk)
-                                with self._lock:
-                                    pbar.update(len(chunk))
+                    if response.status_code != 206:
+                        raise IOError(f"服务器未返回分段内容: {response.status_code}")
+                    # 重新解析得到的地址必须指向同一个文件
+                    total = response.headers.get('content-range', '').rsplit('/', 1)[-1]
+                    expected = source_size or journal.total_size
+                    if total.isdigit() and int(total) != expected:
+                        raise StreamMismatch(f"文件大小不一致: 期望 {expected}, 实际 {total}")
+                    # 每个分段在预分配文件中的自身偏移处写入，无需临时文件
+                    with open(file_path, 'r+b') as f:
+                        f.seek(pos)
+                        checkpoint = pos
+                        first_byte = None
+                        for chunk in self._read_chunks(response, buffer):
+                            if first_byte is None:
+                                first_byte = time.time()
+                                self.metrics.observe('segment_ttfb_seconds', first_byte - attempt_time)
+                            with segment.lock:
+                                chunk = chunk[:segment.end - pos + 1]
+                                segment.pos = pos + len(chunk)
+                            self.limiter.acquire(len(chunk), job, self.host_stats.host(url))
+                            f.write(chunk)
+                            pos += len(chunk)
+                            pbar.update(len(chunk))
+                            # 先落盘数据再记录日志，保证日志中的区间一定已写入
+                            if pos - checkpoint >= self.JOURNAL_CHECKPOINT:
+                                f.flush()
+                                os.fsync(f.fileno())
+                                journal.mark_done(checkpoint, pos - 1)
+                                checkpoint = pos
+                            if pos > segment.end:
+                                break
+                        f.flush()
+                        os.fsync(f.fileno())
+                        if pos > checkpoint:
+                            journal.mark_done(checkpoint, pos - 1)
+                    if pos != segment.end + 1:
+                        raise IOError(f"分段长度不符: 期望 {segment.end - start + 1}, 实际 {pos - start}")
+                elapsed = time.time() - attempt_time
+                self.host_stats.record(url, pos - attempt_start, elapsed)
+                self.metrics.add('bytes_total', pos - attempt_start, host=self.host_stats.host(url))
+                self.metrics.add('segments_total')
+                self.metrics.observe('segment_seconds', elapsed)
+                self.metrics.observe('segment_throughput_bytes', (pos - attempt_start) / elapsed if elapsed > 0 else 0)
                 return True, position
             except Exception as e:
-                if attempt < self.retry:
-                    print(f"分段 {position} 下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
-                    time.sleep(1)
-                else:
+                self.metrics.add('bytes_total', pos - attempt_start, host=self.host_stats.host(url))
+                retry_urls, delay = self._plan_retry(e, url, urls, attempt, 'segment')
+                if retry_urls is None:
                     print(f"分段 {position} 下载失败: {e}")
                     return False, position
+                print(f"分段 {position} 下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
+                urls = retry_urls
+                time.sleep(delay)
+    
+    def _stream_download(self, url, fileobj, pbar, job=None):
+        """按顺序把整个文件写入 fileobj（如管道），重试时用 Range 从已写出的位置继续"""
+        urls = self._current_urls(url)
+        pos = 0
+        total_size = None
+        for attempt in range(self.retry + 1):
+            url = urls[attempt % len(urls)]
+            try:
+                headers = {'Range': f'bytes={pos}-'} if pos else {}
+                with self.buffers.buffer() as buffer, self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    if pos and response.status_code != 206:
+                        raise IOError(f"服务器不支持续传: {response.status_code}")
+                    if total_size is None:
+                        length = response.headers.get('content-length', '')
+                        total_size = int(length) if length.isdigit() else None
+                    for chunk in self._read_chunks(response, buffer):
+                        self.limiter.acquire(len(chunk), job, self.host_stats.host(url))
+                        try:
+                            fileobj.write(chunk)
+                        except BrokenPipeError:
+                            # 读端已关闭（ffmpeg 退出），重试没有意义
+                            print("输出管道已关闭")
+                            return False
+                        pos += len(chunk)
+                        pbar.update(len(chunk))
+                # 提前结束的流会让 ffmpeg 得到截断的输入，从已写出的位置续传
+                if total_size is not None and pos != total_size:
+                    raise IOError(f"文件长度不符: 期望 {total_size}, 实际 {pos}")
+                self.metrics.add('bytes_total', pos, host=self.host_stats.host(url))
+                return True
+            except Exception as e:
+                retry_urls, delay = self._plan_retry(e, url, urls, attempt, 'stream')
+                if retry_urls is None:
+                    print(f"下载失败: {url}, 错误: {e}")
+                    return False
+                print(f"下载失败，尝试重试 ({attempt+1}/{self.retry}): {e}")
+                urls = retry_urls
+                time.sleep(delay)
+    
+    def _fetch_range(self, urls, start, end):
+        """读取一小段字节到内存，返回 (数据, 远端文件大小, 镜像列表)"""
+        for attempt in range(self.retry + 1):
+            url = urls[attempt % len(urls)]
+            try:
+                with self.session.get(url, headers={'Range': f'bytes={start}-{end}'}, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise IOError(f"服务器未返回分段内容: {response.status_code}")
+                    data = response.content
+                if len(data) != end - start + 1:
+                    raise IOError(f"分段长度不符: 期望 {end - start + 1}, 实际 {len(data)}")
+                self.metrics.add('bytes_total', len(data), host=self.host_stats.host(url))
+                total = response.headers.get('content-range', '').rsplit('/', 1)[-1]
+                # 成功的镜像排在首位，后续分片优先使用
+                return data, int(total) if total.isdigit() else None, [url] + [u for u in urls if u != url]
+            except Exception as e:
+                retry_urls, delay = self._plan_retry(e, url, urls, attempt, 'index')
+                if retry_urls is None:
+                    raise
+                urls = retry_urls
+                time.sleep(delay)
+
+    def _probe_clip(self, url, file_path, index, start, end):
+        """按 sidx 把时间区间换算为字节区间，本地文件为初始化段加上覆盖该区间的分片；
+        返回 (下载日志, 本地到远端的偏移, 远端文件大小, 镜像列表, 实际起止秒)"""
+        (init_start, init_end), (index_start, index_end) = index
+        # 初始化段与 sidx 通常相邻，一次请求取回
+        head_start, head_end = min(init_start, index_start), max(init_end, index_end)
+        data, source_size, urls = self._fetch_range(self._current_urls(url), head_start, head_end)
+        init = data[init_start - head_start:init_end - head_start + 1]
+        fragments = parse_sidx(data[index_start - head_start:index_end - head_start + 1], index_start)
+        window = select_fragments(fragments, start, end)
+        if window is None:
+            raise ValueError(f"时间区间 {start:g}s 起超出流的时长 {fragments[-1][1] if fragments else 0:g}s")
+        first, last, clip_start, clip_end = window
+        journal = BLJournal.open(file_path, len(init) + last - first + 1)
+        with open(file_path, 'r+b') as f:
+            f.write(init)
+            f.flush()
+            os.fsync(f.fileno())
+        journal.mark_done(0, len(init) - 1)
+        self.metrics.add('clip_bytes_skipped_total', (source_size or 0) - journal.total_size)
+        return journal, first - len(init), source_size, urls, (clip_start, clip_end)
+
+    def _read_chunks(self, response, buffer):
+        """把响应体依次读入同一块缓冲区，产出已填充部分的 memoryview，调用方须在下一次迭代前用完"""
+        fp = getattr(response.raw, '_fp', None)
+        # 有内容编码时需要 urllib3 解压，只能退回每块分配新对象的 iter_content
+        if not hasattr(fp, 'readinto') or response.headers.get('content-encoding', 'identity') != 'identity':
+            for chunk in response.iter_content(chunk_size=len(buffer)):
+                if chunk:
+                    yield memoryview(chunk)
+            return
+        # 绕过了 urllib3 的长度检查，连接提前断开时 readinto 只返回 0，需按 Content-Length 自行判断
+        length = response.headers.get('content-length', '')
+        remaining = int(length) if length.isdigit() else None
+        while True:
+            # 直接从套接字读入缓冲区，不为每个数据块分配 bytes
+            n = fp.readinto(buffer)
+            if fp.isclosed():
+                # 响应体已读完，连接放回连接池复用
+                response.raw.release_conn()
+            if not n:
+                if remaining:
+                    raise http.client.IncompleteRead(b'', remaining)
+                return
+            if remaining is not None:
+                remaining -= n
+            yield buffer[:n]
     
     def _segmented_download(self, url, file_path, total_size, segment_size):
         """分段下载文件"""
-        segments = []
-        for i in range(0, total_size, segment_size):
-            start = i
-            end = min(i + segment_size - 1, total_size - 1)
-            segments.append((start, end, len(segments)))
+        journal = BLJournal.open(file_path, total_size)
+        segments = [(start, end, i) for i, (start, end) in enumerate(journal.missing(segment_size))]
         
-        with tqdm(desc=os.path.basename(file_path)[0:20], total=total_size, unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+        with BLProgress(os.path.basename(file_path)[0:20], total_size, initial=journal.done_size(), mode=self.progress) as pbar:
             # 创建线程池下载各个分段
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
                 futures = []
                 for start, end, position in segments:
                     future = executor.submit(
-                        self._download_segment, url, file_path, start, end, position, pbar
+                        self._download_segment, url, file_path, start, end, position, pbar, journal
                     )
                     futures.append(future)
                 
                 # 等待所有任务完成
                 results = [future.result() for future in futures]
                 
-                # 检查是否所有分段都成功下载
+                # 检查是否所有分段都成功下载，失败时保留日志以便续传
                 if not all(success for success, _ in results):
-                    print("部分分段下载失败，无法合并文件")
+                    print("部分分段下载失败")
                     return None
         
-        # 合并文件分段
-        with open(file_path, 'wb') as outfile:
-            for i in range(len(segments)):
-                temp_file = f"{file_path}.part{i}"
-                with open(temp_file, 'rb') as infile:
-                    outfile.write(infile.read())
-                os.remove(temp_file)
-        
+        journal.remove()
         print(f"文件下载完成: {file_path}")
         return file_path
     
@@ -153,62 +471,183 @@ class MultiThreadDownloader:
                 raise ValueError("URLs and file names must have the same length.")
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
                 futures = [executor.submit(self.download_file, url, save_path, file_name, use_segments, segment_size) for url, file_name in zip(urls, file_names)]
-                p_bar = tqdm(total=len(futures), desc="Downloading files")
+                p_bar = tqdm(total=len(futures), desc="Downloading files", disable=self.progress != 'tqdm')
                 for future in concurrent.futures.as_completed(futures):
                     p_bar.update(1)
         else:
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
                 futures = [executor.submit(self.download_file, url, save_path, use_segments=use_segments, segment_size=segment_size) for url in urls]
-                p_bar = tqdm(total=len(futures), desc="Downloading files")
+                p_bar = tqdm(total=len(futures), desc="Downloading files", disable=self.progress != 'tqdm')
                 for future in concurrent.futures.as_completed(futures):
                     p_bar.update(1)
         p_bar.close()
+        # 按输入顺序返回各文件的保存路径，失败的为 None
+        return [future.result() for future in futures]
 
 
 class BLDownloader(BLAuth, MultiThreadDownloader):
-    def __init__(self, max_workers=5, chunk_size=1024*1024, timeout=30, retry=3, headers=None, ffmpeg_path=None):
-        MultiThreadDownloader.__init__(self, max_workers, chunk_size, timeout, retry, headers)
+    # 同一集的 playinfo 在此时间内只重新获取一次，并发过期的分段共用结果
+    REFRESH_INTERVAL = 60
+    
+    def __init__(self, max_workers=5, chunk_size=1024*1024, timeout=30, retry=3, headers=None, ffmpeg_path=None, engine='thread', adaptive=False, meta_cache=True, progress='tqdm', stats_file=None, stats_interval=10, limiter=None, media_store=True, store_quota=0, http2=False, memory_budget=0):
+        MultiThreadDownloader.__init__(self, max_workers, chunk_size, timeout, retry, headers, adaptive, progress, limiter, memory_budget)
         BLAuth.__init__(self)
-        self.merger = BLMerger(ffmpeg_path)
+        # 登录、元数据请求与媒体会话共用同一个连接池；媒体会话不带 cookie，
+        # 登录凭据不会发往 backupUrl 等第三方镜像主机
+        self.pool.mount(self)
+        # 可选：pagelist/playinfo 等小请求改用 HTTP/2 在一条连接上多路复用
+        self.http2 = http2
+        self._http2_client = None
+        # 流地址 -> (bvid, pid, cid, 类型, 清晰度, 编码)，用于地址过期后重新解析
+        self._stream_sources = {}
+        self._refreshed = {}
+        self._refresh_lock = threading.Lock()
+        self.merger = BLMerger(ffmpeg_path, metrics=self.metrics)
+        # 定期把指标快照写入文件，供外部采集
+        self.stats_writer = BLStatsWriter(self.metrics, stats_file, stats_interval).start() if stats_file else None
+        self.host_stats = BLHostStats(os.path.join(self.data_path, 'cache', 'hosts.json'))
+        self.meta_cache = BLMetaCache(os.path.join(self.data_path, 'cache', 'meta.db')) if meta_cache else None
+        # 按流标识去重的媒体仓库，同一集下载到不同目录或改名后无需重新下载
+        self.media_store = BLMediaStore(os.path.join(self.data_path, 'store'), store_quota) if media_store else None
+        # 媒体传输后端: 'thread' 使用线程池, 'async' 使用单事件循环
+        if engine == 'thread':
+            self.engine = self
+        elif engine == 'async':
+            # 异步后端没有缓冲池，按内存预算换算出的块大小和块数限制读取大小与在途请求数
+            self.engine = AsyncDownloader(max_workers, self.buffers.buffer_size, timeout, retry, headers,
+                                          max_inflight=min(max_workers, self.buffers.count), limiter=self.limiter,
+                                          progress=self.progress)
+        else:
+            raise ValueError(f"Unknown download engine: {engine}")
         
-    def _get_detail_av_url(self, title, bvid, pid, retry=3):
-        url = self.VIDEO_URL.format(bvid, pid)
+    def _get_metadata(self, url):
+        if not self.http2:
+            resp = self.get(url)
+        else:
+            with self._lock:
+                # 登录完成后才创建，以便带上最新的 cookie
+                if self._http2_client is None:
+                    self._http2_client = BLConnectionPool.http2_client(self.headers, self.cookies, self.timeout)
+            resp = self._http2_client.get(url)
+        resp.raise_for_status()
+        return resp
+    
+    def _get_playinfo(self, bvid, pid, cid=None):
+        if self.meta_cache is not None and cid is not None:
+            playinfo = self.meta_cache.get_playinfo(bvid, cid)
+            if playinfo is not None:
+                return playinfo
+        resp = self._get_metadata(self.VIDEO_URL.format(bvid, pid))
+        resp.encoding = 'utf-8'
+        playinfo = extract_playinfo(resp.text)
+        # 未登录或出错时页面不含 dash 数据，不写入缓存
+        if self.meta_cache is not None and cid is not None and 'dash' in (playinfo.get('data') or {}):
+            self.meta_cache.put_playinfo(bvid, cid, playinfo)
+        return playinfo
+    
+    def _get_detail_av_url(self, title, bvid, pid, cid=None, retry=3):
         for attempt in range(retry + 1):
             try:
-                resp = self.get(url)
-                resp.encoding = 'utf-8'
-                html = etree.HTML(resp.text)
-                avurls = [s for s in html.xpath('//head[@itemprop="video"]/script/text()') if 'window.__playinfo__' in s][0].replace('window.__playinfo__=','')
-                avurls = json.loads(avurls)
-                video_url = avurls['data']['dash']['video'][0]['baseUrl']
-                audio_url = avurls['data']['dash']['audio'][0]['baseUrl']
-                return title, video_url, audio_url
+                avurls = self._get_playinfo(bvid, pid, cid)
+                # 主地址之后附上 backupUrl 中的镜像地址
+                video = avurls['data']['dash']['video'][0]
+                audio = avurls['data']['dash']['audio'][0]
+                video_urls = self._remember_stream(bvid, pid, cid, 'video', video)
+                audio_urls = self._remember_stream(bvid, pid, cid, 'audio', audio)
+                # 清晰度与编码决定了流的内容，用作媒体仓库的标识
+                stream_ids = [f"{stream.get('id')}-{stream.get('codecs')}" for stream in (video, audio)]
+                # SegmentBase 给出初始化段和 sidx 的位置，片段下载需要音视频都有
+                indexes = (segment_base(video), segment_base(audio))
+                return title, video_urls, audio_urls, stream_ids, indexes if all(indexes) else None
             except Exception as e:
-                if attempt < retry:
+                if attempt < retry and self.retry_policy.classify(e) != FATAL:
+                    self.metrics.add('retries_total', kind='playinfo')
                     self.logger.warning(f"Fetching video data failed, retrying ({attempt+1}/{retry}): {e}")
-                    time.sleep(1)
+                    time.sleep(self.retry_policy.delay(attempt, e))
                 else:
                     self.logger.error(f"Fetching video data failed {title}: {e}")
-                    return title, None, None
+                    return title, None, None, None, None
+    
+    def _remember_stream(self, bvid, pid, cid, kind, stream):
+        """返回流的镜像地址（baseUrl 之后附上 backupUrl），并记录其来源"""
+        urls = [stream['baseUrl']] + (stream.get('backupUrl') or stream.get('backup_url') or [])
+        source = (bvid, pid, cid, kind, stream.get('id'), stream.get('codecs'))
+        for url in urls:
+            self._stream_sources[url] = source
+        return urls
+    
+    def _refresh_urls(self, urls):
+        """签名过期后重新获取 playinfo，返回同一清晰度和编码的流的新地址"""
+        source = next((self._stream_sources[url] for url in urls if url in self._stream_sources), None)
+        if source is None:
+            return None
+        bvid, pid, cid, kind, stream_id, codecs = source
+        with self._refresh_lock:
+            refreshed_at, playinfo, issued = self._refreshed.get((bvid, cid), (0, None, set()))
+            # 失败的已经是最近一次解析出的地址时，即使刚解析过也要重新获取
+            if time.time() - refreshed_at > self.REFRESH_INTERVAL or issued.intersection(urls):
+                if self.meta_cache is not None and cid is not None:
+                    self.meta_cache.invalidate_playinfo(bvid, cid)
+                try:
+                    playinfo = self._get_playinfo(bvid, pid, cid)
+                except Exception as e:
+                    self.logger.warning(f"Refreshing stream URLs of {bvid} p{pid} failed: {e}")
+                    return None
+                dash = (playinfo.get('data') or {}).get('dash') or {}
+                issued = {url for stream in dash.get('video', []) + dash.get('audio', []) for url in [stream.get('baseUrl')] + (stream.get('backupUrl') or stream.get('backup_url') or [])}
+                self._refreshed[(bvid, cid)] = (time.time(), playinfo, issued)
+                self.metrics.add('url_refreshes_total')
+        streams = ((playinfo or {}).get('data') or {}).get('dash', {}).get(kind) or []
+        for stream in streams:
+            if stream.get('id') == stream_id and stream.get('codecs') == codecs:
+                fresh = self._remember_stream(bvid, pid, cid, kind, stream)
+                with self._lock:
+                    for url in urls:
+                        self._url_aliases[url] = fresh
+                return fresh
+        self.logger.warning(f"Stream {kind} {stream_id}/{codecs} of {bvid} p{pid} is no longer offered")
+        return None
+    
+    def _forget_streams(self, bvid):
+        """任务结束后丢弃该 bvid 的地址记录，常驻进程中不会无限增长"""
+        with self._refresh_lock, self._lock:
+            for url in [url for url, source in self._stream_sources.items() if source[0] == bvid]:
+                del self._stream_sources[url]
+                self._url_aliases.pop(url, None)
+            for key in [key for key in self._refreshed if key[0] == bvid]:
+                del self._refreshed[key]
+    
+    def _get_pagelist(self, bvid):
+        if self.meta_cache is not None:
+            pages = self.meta_cache.get_pagelist(bvid)
+            if pages is not None:
+                return pages
+        resp = self._get_metadata(self.CID_URL.format(bvid))
+        resp.encoding = 'utf-8'
+        pages = resp.json()['data']
+        if self.meta_cache is not None and pages:
+            self.meta_cache.put_pagelist(bvid, pages)
+        return pages
     
     def _get_bvid_data(self, bvid):
         try:
-            resp = self.get(self.CID_URL.format(bvid))
-            resp.encoding = 'utf-8'
             episodes = { ep['part']: {
                 "title": ep['part'],
                 "pid": pid + 1,
+                "cid": ep.get('cid'),
                 "bvid": bvid,
-            } for pid, ep in enumerate(resp.json()['data']) }
+            } for pid, ep in enumerate(self._get_pagelist(bvid)) }
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = [executor.submit(self._get_detail_av_url, ep['title'], bvid, ep['pid']) for ep in episodes.values()]
-                p_bar = tqdm(total=len(futures), desc="Fetching video data")
+                futures = [executor.submit(self._get_detail_av_url, ep['title'], bvid, ep['pid'], ep['cid']) for ep in episodes.values()]
+                p_bar = tqdm(total=len(futures), desc="Fetching video data", disable=self.progress != 'tqdm')
                 for future in concurrent.futures.as_completed(futures):
                     p_bar.update(1)
-                    title, video_url, audio_url = future.result()
-                    if video_url and audio_url:
-                        episodes[title]['video_url'] = video_url
-                        episodes[title]['audio_url'] = audio_url
+                    title, video_urls, audio_urls, stream_ids, indexes = future.result()
+                    if video_urls and audio_urls:
+                        episodes[title]['video_urls'] = video_urls
+                        episodes[title]['audio_urls'] = audio_urls
+                        episodes[title]['indexes'] = indexes
+                        episodes[title]['store_key'] = BLMediaStore.key(bvid, episodes[title]['cid'], *stream_ids)
                     else:
                         self.logger.error(f"Failed to fetch video/audio URL for {title}")
             p_bar.close()
@@ -218,14 +657,68 @@ class BLDownloader(BLAuth, MultiThreadDownloader):
             return None
 
     def _check_cache(self, save_path, file_name):
-        if os.path.exists(os.path.join(save_path, file_name)):
+        file_path = os.path.join(save_path, file_name)
+        # 存在下载日志说明文件未完整下载
+        if os.path.exists(file_path) and not BLJournal.exists(file_path):
             return True
         return False
 
-    def download_bvid(self, bvid, save_path=None, use_segments=False, segment_size=10*1024*1024, cache=True):
+    def _direct_mux(self, video_urls, audio_urls, output_path, pbar, job=None):
+        """音视频边下载边通过管道送入同一个 ffmpeg，只有最终文件落盘"""
+        temp_path = f"{output_path}.tmp"
+        try:
+            process, video_pipe, audio_pipe = self.merger.open_pipe_mux(temp_path)
+        except OSError as e:
+            self.logger.error(f"Failed to start ffmpeg for {os.path.basename(output_path)}: {e}")
+            return None
+        results = {}
+        
+        def feed(name, urls, pipe):
+            with pipe:
+                results[name] = self._stream_download(urls, pipe, pbar, job)
+        
+        feeders = [
+            threading.Thread(target=feed, args=('video', video_urls, video_pipe), daemon=True),
+            threading.Thread(target=feed, args=('audio', audio_urls, audio_pipe), daemon=True),
+        ]
+        for feeder in feeders:
+            feeder.start()
+        # 两个写线程各自阻塞在自己的管道上，ffmpeg 按需交替读取，不会互相等待
+        _, stderr = process.communicate()
+        for feeder in feeders:
+            feeder.join()
+        if process.returncode != 0 or not all(results.get(name) for name in ('video', 'audio')):
+            error = stderr.decode('utf-8', errors='replace').strip().splitlines()
+            self.logger.error(f"Direct mux failed {os.path.basename(output_path)} (exit {process.returncode}): {error[-1] if error else ''}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        os.replace(temp_path, output_path)
+        return output_path
+    
+    def _direct_mux_all(self, tasks, job=None):
+        """并发直连合并多集，每集占用两个连接和一个 ffmpeg 进程"""
+        # 每集同时占用两块读缓冲区，缓冲池不够时减少同时合并的集数，避免互相等待
+        workers = max(1, min(self.max_workers // 2, self.merger.max_workers, self.buffers.count // 2))
+        with BLProgress("Streaming into ffmpeg", mode=self.progress) as pbar:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self._direct_mux, video_urls, audio_urls, output_path, pbar, job) for video_urls, audio_urls, output_path in tasks]
+                return [future.result() for future in futures]
+    
+    def download_bvid(self, bvid, save_path=None, use_segments=False, segment_size=10*1024*1024, cache=True, on_stage=None, direct_mux=False, weight=1, rate=0, cancel=None, clip=None):
+        # clip 为 (起始秒, 结束秒或 None) 时每集只下载覆盖该时间区间的分片
         if not bvid:
             self.logger.error("BVID is required.")
-            return
+            return False
+        # 以 bvid 为单位参与带宽分配，权重越高分得的总带宽越多，rate 为该任务自身的上限
+        self.limiter.register_job(bvid, weight, rate)
+        try:
+            return self._download_bvid(bvid, save_path, use_segments, segment_size, cache, on_stage, direct_mux, cancel, clip)
+        finally:
+            self.limiter.unregister_job(bvid)
+            self._forget_streams(bvid)
+    
+    def _download_bvid(self, bvid, save_path, use_segments, segment_size, cache, on_stage, direct_mux, cancel=None, clip=None):
         if save_path is None:
             save_path = os.path.join(os.getcwd(), 'data', 'downloads', bvid)
         if not os.path.exists(save_path):
@@ -234,39 +727,155 @@ class BLDownloader(BLAuth, MultiThreadDownloader):
         episodes = self._get_bvid_data(bvid)
         if not episodes:
             self.logger.error("No episodes found.")
-            return
+            return False
         
+        # 所有剧集的音视频流交给同一个调度器，保持固定数量的传输同时进行
+        # cancel 只能中断调度器中的分段传输，直连合并和异步后端在阶段之间检查
+        scheduler = TransferScheduler(self, adaptive=self.adaptive, cancel=cancel)
+        # 每集的音视频都下载完成后立即提交合并，下载与合并并行
+        self.merger.start()
+        # 只等待本任务提交的合并，合并器可能同时在为其他任务工作
+        merges = []
+        success = True
+        pairs = []
+        if direct_mux and not self.merger.supports_pipe_mux():
+            self.logger.warning("Direct mux needs POSIX pipes, falling back to separate download and merge.")
+            direct_mux = False
+        if clip is not None and direct_mux:
+            self.logger.warning("Clip downloads fetch fragments by range, direct mux is disabled.")
+            direct_mux = False
+        # 片段需要按 sidx 换算字节区间，只有线程调度器支持，异步后端只处理完整下载
+        threaded = self.engine is self or clip is not None
+        direct_jobs = []
+        store_keys = {}
         for ep in episodes.values():
             title = ep['title']
-            video_url = ep['video_url']
-            audio_url = ep['audio_url']
-            video_file = f"{pathvalidate.sanitize_filename(title, '_')}_video.mp4"
-            audio_file = f"{pathvalidate.sanitize_filename(title, '_')}_audio.mp4"
-            final_file = f"{pathvalidate.sanitize_filename(title, '_')}.mp4"
-            if cache and ((self._check_cache(save_path, video_file) and self._check_cache(save_path, audio_file)) or self._check_cache(save_path, final_file)):
-                self.logger.info(f"File already exists: {video_file} and {audio_file}, skipping download.")
+            video_urls = ep.get('video_urls')
+            audio_urls = ep.get('audio_urls')
+            name = pathvalidate.sanitize_filename(title, '_')
+            indexes = ep.get('indexes') if clip is not None else None
+            if clip is not None and indexes is None and video_urls:
+                self.logger.warning(f"No segment index for {title}, downloading the whole episode.")
+            if indexes is not None:
+                name += clip_suffix(*clip)
+            video_path = os.path.join(save_path, f"{name}_video.mp4")
+            audio_path = os.path.join(save_path, f"{name}_audio.mp4")
+            final_path = os.path.join(save_path, f"{name}.mp4")
+            if cache and self._check_cache(save_path, os.path.basename(final_path)):
+                self.logger.info(f"File already exists: {os.path.basename(final_path)}, skipping download.")
+                continue
+            store_key = ep.get('store_key')
+            if store_key and indexes is not None:
+                store_key = BLMediaStore.key(store_key, *clip)
+            if cache and store_key and self.media_store is not None and self.media_store.link(store_key, final_path):
+                self.logger.info(f"Reused {os.path.basename(final_path)} from the media store.")
+                self.metrics.add('store_hits_total')
+                continue
+            if store_key:
+                store_keys[final_path] = store_key
+            # 片段文件不含 sidx，无法得知其起点，留下的片段文件不复用而是重新下载
+            if cache and indexes is None and self._check_cache(save_path, os.path.basename(video_path)) and self._check_cache(save_path, os.path.basename(audio_path)):
+                self.logger.info(f"File already exists: {os.path.basename(video_path)} and {os.path.basename(audio_path)}, skipping download.")
+                merges.append(self.merger.submit(video_path, audio_path, final_path))
                 continue
-            if not video_url or not audio_url:
+            if not video_urls or not audio_urls:
                 self.logger.error(f"Missing video/audio URL for {title}, skipping download.")
+                success = False
                 continue
-            self.download_files(
-                urls=[video_url, audio_url],
+            if direct_mux:
+                direct_jobs.append((video_urls, audio_urls, final_path))
+                continue
+            on_done = self._merge_when_ready(video_path, audio_path, final_path, merges) if threaded else None
+            video_clip = (indexes[0], *clip) if indexes is not None else None
+            audio_clip = (indexes[1], *clip) if indexes is not None else None
+            scheduler.add(video_urls, video_path, segment_size, use_segments, on_done, bvid, video_clip)
+            scheduler.add(audio_urls, audio_path, segment_size, use_segments, on_done, bvid, audio_clip)
+            pairs.append((video_path, audio_path, final_path))
+        if on_stage is not None:
+            on_stage('downloading')
+        if cancel is not None and cancel.is_set():
+            scheduler.streams, direct_jobs, success = [], [], False
+        if threaded:
+            if not scheduler.run():
+                success = False
+            self.logger.info(f"Downloaded {scheduler.bytes_done / 1024 / 1024:.1f} MB in {scheduler.elapsed:.1f}s ({scheduler.throughput() / 1024 / 1024:.2f} MB/s)")
+            for stream in scheduler.streams:
+                if stream.window is not None:
+                    # 分片边界对齐关键帧，实际区间通常比请求的略宽
+                    self.logger.info(f"Clip {os.path.basename(stream.file_path)} covers {stream.window[0]:g}s-{stream.window[1]:g}s, {stream.total_size / 1024 / 1024:.1f} of {(stream.source_size or 0) / 1024 / 1024:.1f} MB")
+        elif scheduler.streams:
+            # 异步后端本身在单个事件循环中调度全部流，完成后统一提交合并；
+            # 它不做镜像切换，只使用历史吞吐最高的镜像
+            self.engine.download_files(
+                urls=[self.host_stats.rank(st.url)[0] for st in scheduler.streams],
                 save_path=save_path,
-                file_names=[video_file, audio_file],
+                file_names=[os.path.basename(st.file_path) for st in scheduler.streams],
                 use_segments=use_segments,
-                segment_size=segment_size
+                segment_size=segment_size,
+                job=bvid
             )
+            for video_path, audio_path, final_path in pairs:
+                if self._check_cache(save_path, os.path.basename(video_path)) and self._check_cache(save_path, os.path.basename(audio_path)):
+                    merges.append(self.merger.submit(video_path, audio_path, final_path))
+                else:
+                    success = False
         
-        self.merger.add(
-            video_path=[os.path.join(save_path, f"{pathvalidate.sanitize_filename(ep['title'], '_')}_video.mp4") for ep in episodes.values()],
-            audio_path=[os.path.join(save_path, f"{pathvalidate.sanitize_filename(ep['title'], '_')}_audio.mp4") for ep in episodes.values()],
-            output_path=[os.path.join(save_path, f"{pathvalidate.sanitize_filename(ep['title'], '_')}.mp4") for ep in episodes.values()],
-        )
-        self.merger.run()
+        if cancel is not None and cancel.is_set():
+            direct_jobs, success = [], False
+        muxed = self._direct_mux_all(direct_jobs, bvid) if direct_jobs else []
+        if not all(muxed):
+            success = False
         
-        for ep in episodes.values():
-            os.remove(os.path.join(save_path, f"{pathvalidate.sanitize_filename(ep['title'], '_')}_video.mp4"))
-            os.remove(os.path.join(save_path, f"{pathvalidate.sanitize_filename(ep['title'], '_')}_audio.mp4"))
+        if on_stage is not None:
+            on_stage('merging')
+        merged = self.merger.join(merges)
+        self._store_outputs(store_keys, muxed + merged)
+        self.host_stats.save()
+        pool = self.pool.stats()
+        for name, value in pool.items():
+            self.metrics.set(f'http_pool_{name}', value)
+        self.logger.info(f"HTTP connections: {pool['connections']} opened for {pool['requests']} requests ({pool['reused']} reused)")
+        buffers = self.buffers.stats()
+        for name, value in buffers.items():
+            self.metrics.set(f'buffer_pool_{name}', value)
+        self.metrics.set('peak_rss_bytes', peak_rss())
+        self.logger.info(f"Peak RSS {peak_rss() / 1024 / 1024:.1f} MB, buffer pool {buffers['bytes'] / 1024 / 1024:.1f} MB ({buffers['waits']} waits)")
+        if self.stats_writer is not None:
+            self.stats_writer.write()
+        if not all(merged):
+            success = False
+        return success
+    
+    def _store_outputs(self, store_keys, outputs):
+        """把合并成功的文件收入媒体仓库，仓库失败不影响本次下载结果"""
+        if self.media_store is None:
+            return
+        for output_path in outputs:
+            if output_path is None or output_path not in store_keys:
+                continue
+            try:
+                self.media_store.put(store_keys[output_path], output_path)
+            except (OSError, sqlite3.Error) as e:
+                self.logger.warning(f"Failed to add {os.path.basename(output_path)} to the media store: {e}")
+    
+    def _merge_when_ready(self, video_path, audio_path, output_path, merges):
+        """返回流完成回调：同一集的两个流都成功后提交合并，合并任务追加到 merges"""
+        done = {}
+        lock = threading.Lock()
+        
+        def on_done(stream, success):
+            if not success:
+                self.logger.error(f"Download failed: {os.path.basename(stream.file_path)}")
+                return
+            with lock:
+                done[stream.file_path] = stream.window
+                ready = len(done) == 2
+            if ready:
+                # 片段的音视频分片边界不同，按实际起点对齐
+                video_window, audio_window = done[video_path], done[audio_path]
+                offset = audio_window[0] - video_window[0] if video_window and audio_window else 0
+                merges.append(self.merger.submit(video_path, audio_path, output_path, offset=offset))
+        return on_done
             
 
 def main():
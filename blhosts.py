@@ -0,0 +1,73 @@
+import os
+import json
+import threading
+from urllib.parse import urlparse
+
+
+class BLHostStats():
+    # 吞吐量的指数移动平均系数
+    ALPHA = 0.3
+    # 失败一次对评分的惩罚系数
+    ERROR_PENALTY = 0.5
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hosts = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.hosts = json.load(f)
+            except (OSError, ValueError):
+                self.hosts = {}
+
+    @staticmethod
+    def host(url):
+        return urlparse(url).netloc
+
+    def _entry(self, host):
+        return self.hosts.setdefault(host, {'throughput': 0, 'bytes': 0, 'errors': 0})
+
+    def record(self, url, nbytes, seconds):
+        if seconds <= 0 or nbytes <= 0:
+            return
+        with self._lock:
+            entry = self._entry(self.host(url))
+            rate = nbytes / seconds
+            entry['throughput'] = rate if not entry['throughput'] else self.ALPHA * rate + (1 - self.ALPHA) * entry['throughput']
+            entry['bytes'] += nbytes
+
+    def record_error(self, url):
+        with self._lock:
+            entry = self._entry(self.host(url))
+            entry['errors'] += 1
+            entry['throughput'] *= self.ERROR_PENALTY
+
+    def score(self, url):
+        with self._lock:
+            entry = self.hosts.get(self.host(url))
+            return entry['throughput'] if entry else None
+
+    def known(self, urls):
+        return any(self.score(url) for url in urls)
+
+    def rank(self, urls):
+        """按历史吞吐量从高到低排序，其后是没有记录的主机，只出过错的主机排在最后"""
+        def key(item):
+            index, url = item
+            score = self.score(url)
+            group = 0 if score else (1 if score is None else 2)
+            return (group, -(score or 0), index)
+        return [url for _, url in sorted(enumerate(urls), key=key)]
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.hosts, ensure_ascii=False, indent=4)
+        # 并发的任务可能同时保存，各自使用独立的临时文件
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,62 @@
+import threading
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class BLConnectionPool():
+    """按并发数设置每个主机的连接池大小，可挂载到多个会话上，并统计 keep-alive 连接复用情况"""
+    # 同时保留连接池的主机数：接口、页面以及若干个 CDN 镜像
+    POOL_HOSTS = 16
+
+    def __init__(self, pool_size, pool_hosts=None):
+        self.pool_size = pool_size
+        # pool_block=False：超出池大小时仍可新建连接，只是用完后不再保留
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts or self.POOL_HOSTS, pool_maxsize=pool_size)
+        self._retired = {'connections': 0, 'requests': 0}
+        self._lock = threading.Lock()
+        # 主机数超过上限时最久未用的连接池会被丢弃，先把它的计数保存下来
+        pools = self.adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def retire(pool):
+            with self._lock:
+                self._retired['connections'] += pool.num_connections
+                self._retired['requests'] += pool.num_requests
+            if dispose is not None:
+                dispose(pool)
+            else:
+                pool.close()
+        pools.dispose_func = retire
+
+    def mount(self, session):
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def stats(self):
+        """新建连接数、请求数，以及复用已有连接的请求数"""
+        pools = self.adapter.poolmanager.pools
+        with self._lock:
+            connections, requests = self._retired['connections'], self._retired['requests']
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests += pool.num_requests
+        return {
+            'hosts': len(pools),
+            'connections': connections,
+            'requests': requests,
+            'reused': max(0, requests - connections),
+        }
+
+    @staticmethod
+    def http2_client(headers, cookies, timeout):
+        """元数据请求使用的 HTTP/2 客户端，多个小请求在同一条连接上多路复用"""
+        if httpx is None:
+            raise ImportError("HTTP/2 metadata requests require httpx: pip install 'httpx[http2]'")
+        return httpx.Client(http2=True, headers=dict(headers), cookies=cookies, timeout=timeout, follow_redirects=True)
@@ -0,0 +1,86 @@
+import os
+import json
+import threading
+
+
+class BLJournal():
+    SUFFIX = '.journal'
+
+    def __init__(self, file_path, total_size, done=None):
+        self.file_path = file_path
+        self.journal_path = f"{file_path}{self.SUFFIX}"
+        self.total_size = total_size
+        self.done = [list(r) for r in done] if done else []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def exists(cls, file_path):
+        return os.path.exists(f"{file_path}{cls.SUFFIX}")
+
+    @classmethod
+    def load(cls, file_path):
+        try:
+            with open(f"{file_path}{cls.SUFFIX}", 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(file_path, int(data['total_size']), data.get('done', []))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @classmethod
+    def open(cls, file_path, total_size):
+        """载入可用的下载日志，否则预分配文件并新建日志"""
+        journal = cls.load(file_path)
+        if journal is not None and journal.total_size == total_size \
+                and os.path.exists(file_path) and os.path.getsize(file_path) == total_size:
+            return journal
+        with open(file_path, 'wb') as f:
+            f.truncate(total_size)
+        journal = cls(file_path, total_size)
+        journal.save()
+        return journal
+
+    def save(self):
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'total_size': self.total_size, 'done': self.done}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def remove(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def mark_done(self, start, end):
+        """记录 [start, end] 已写入磁盘，合并相邻区间后落盘"""
+        with self._lock:
+            ranges = sorted(self.done + [[start, end]])
+            merged = []
+            for s, e in ranges:
+                if merged and s <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], e)
+                else:
+                    merged.append([s, e])
+            self.done = merged
+            self.save()
+
+    def done_size(self):
+        with self._lock:
+            return sum(e - s + 1 for s, e in self.done)
+
+    def missing(self, segment_size):
+        """返回尚未完成的区间，按 segment_size 切分为 (start, end)"""
+        with self._lock:
+            gaps = []
+            pos = 0
+            for s, e in self.done:
+                if s > pos:
+                    gaps.append((pos, s - 1))
+                pos = max(pos, e + 1)
+            if pos < self.total_size:
+                gaps.append((pos, self.total_size - 1))
+        segments = []
+        for s, e in gaps:
+            for i in range(s, e + 1, segment_size):
+                segments.append((i, min(i + segment_size - 1, e)))
+        return segments
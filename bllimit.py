@@ -0,0 +1,165 @@
+import time
+import threading
+import multiprocessing
+
+
+class TokenBucket():
+    """令牌桶，rate 为 0 表示不限速；允许令牌透支，调用方按欠额等待"""
+
+    def __init__(self, rate=0, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = self._capacity()
+        self.updated = time.monotonic()
+
+    def _capacity(self):
+        # 默认允许一秒的突发量
+        return self.burst if self.burst else self.rate
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+        self.tokens = min(self.tokens, self._capacity())
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self._capacity(), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n):
+        """扣除 n 个令牌，返回需要等待的秒数"""
+        if not self.rate:
+            return 0
+        self._refill()
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+def _shared_field(index):
+    return property(lambda self: self._state[index], lambda self, value: self._state.__setitem__(index, value))
+
+
+class SharedTokenBucket(TokenBucket):
+    """状态放在共享内存中的令牌桶，批量模式的多个工作进程共用同一个总上限，空闲进程的份额不会浪费"""
+    rate = _shared_field(0)
+    burst = _shared_field(1)
+    tokens = _shared_field(2)
+    # time.monotonic 在同一台机器的各进程间可比
+    updated = _shared_field(3)
+
+    def __init__(self, rate=0, burst=None):
+        self._state = multiprocessing.Array('d', 4)
+        with self._state.get_lock():
+            super().__init__(rate, burst or 0)
+
+    def set_rate(self, rate):
+        with self._state.get_lock():
+            super().set_rate(rate)
+
+    def reserve(self, n):
+        with self._state.get_lock():
+            return super().reserve(n)
+
+
+class BLBandwidthLimiter():
+    """全局带宽预算：总上限、可选的单主机与单任务上限，并按权重在活跃任务之间分配总带宽；
+    接近完成的任务权重逐渐提高，先结束的任务尽早让出带宽"""
+    # 完成比例为 1 时权重提高到原来的 1 + NEAR_DONE_BOOST 倍
+    NEAR_DONE_BOOST = 1.0
+
+    def __init__(self, global_rate=0, host_rate=0, global_bucket=None):
+        self.global_rate = global_rate
+        self.host_rate = host_rate
+        # 可传入 SharedTokenBucket，使总上限跨进程生效
+        self._global = global_bucket if global_bucket is not None else TokenBucket(global_rate)
+        self._hosts = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _rebalance(self):
+        # 在锁内调用：总上限按权重分给活跃任务，份额超过自身上限的任务按上限计，
+        # 多出的带宽再按权重分给其余任务
+        weights = {name: job['weight'] * (1 + self.NEAR_DONE_BOOST * job['progress']) for name, job in self._jobs.items()}
+        rates = {name: job['rate'] for name, job in self._jobs.items()}
+        if self.global_rate:
+            remaining, sharing = self.global_rate, set(weights)
+            while sharing:
+                total_weight = sum(weights[name] for name in sharing)
+                capped = {name for name in sharing if self._jobs[name]['rate'] and self._jobs[name]['rate'] < remaining * weights[name] / total_weight}
+                if not capped:
+                    for name in sharing:
+                        rates[name] = remaining * weights[name] / total_weight
+                    break
+                remaining -= sum(self._jobs[name]['rate'] for name in capped)
+                sharing -= capped
+        for name, job in self._jobs.items():
+            job['bucket'].set_rate(rates[name])
+
+    def register_job(self, job, weight=1, rate=0):
+        with self._lock:
+            self._jobs[job] = {'weight': weight, 'rate': rate, 'progress': 0, 'bucket': TokenBucket()}
+            self._rebalance()
+
+    def unregister_job(self, job):
+        with self._lock:
+            if self._jobs.pop(job, None) is not None:
+                self._rebalance()
+
+    def set_weight(self, job, weight):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs[job]['weight'] = weight
+                self._rebalance()
+
+    def set_job_rate(self, job, rate):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs[job]['rate'] = rate
+                self._rebalance()
+
+    def set_progress(self, job, progress):
+        """更新任务的完成比例（0~1）"""
+        with self._lock:
+            if job in self._jobs:
+                self._jobs[job]['progress'] = min(max(progress, 0), 1)
+                self._rebalance()
+
+    def set_global_rate(self, rate):
+        with self._lock:
+            self.global_rate = rate
+            self._global.set_rate(rate)
+            self._rebalance()
+
+    def set_host_rate(self, rate):
+        with self._lock:
+            self.host_rate = rate
+            for bucket in self._hosts.values():
+                bucket.set_rate(rate)
+
+    def acquire(self, n, job=None, host=None):
+        """为 n 字节扣除各级令牌，并等待其中最长的欠额"""
+        wait = self.reserve(n, job, host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, n, job=None, host=None):
+        """扣除令牌但不等待，返回需要等待的秒数；异步传输用它配合 asyncio.sleep"""
+        with self._lock:
+            wait = self._global.reserve(n)
+            if host and self.host_rate:
+                bucket = self._hosts.get(host)
+                if bucket is None:
+                    bucket = self._hosts[host] = TokenBucket(self.host_rate)
+                wait = max(wait, bucket.reserve(n))
+            if job in self._jobs:
+                wait = max(wait, self._jobs[job]['bucket'].reserve(n))
+        return wait
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'global_rate': self.global_rate,
+                'host_rate': self.host_rate,
+                'jobs': {str(job): {'weight': info['weight'], 'rate': info['rate'], 'progress': info['progress'], 'effective_rate': info['bucket'].rate} for job, info in self._jobs.items()},
+            }
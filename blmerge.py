@@ -1,14 +1,28 @@
 import concurrent.futures
 from tqdm import tqdm
 import subprocess
+import threading
+import loguru
+import time
+import os
+from blmetrics import BLMetrics
 
 
 class BLMerger():
-    def __init__(self, ffmpeg_path=None):
+    def __init__(self, ffmpeg_path=None, max_workers=None, metrics=None):
         self.video_path = []
         self.audio_path = []
         self.output_path = []
         self.ffmpeg_path = ffmpeg_path if ffmpeg_path else "ffmpeg"
+        # 每个合并任务占用一个 ffmpeg 进程，默认与 CPU 核数相同
+        self.max_workers = max_workers if max_workers else (os.cpu_count() or 1)
+        self.logger = loguru.logger
+        self.metrics = metrics if metrics is not None else BLMetrics()
+        self._executor = None
+        self._futures = []
+        # 同一个合并器可被并发的多个下载任务共用，最后一个任务结束时才关闭线程池
+        self._users = 0
+        self._lock = threading.Lock()
         
     def add(self, video_path, audio_path, output_path):
         if (type(video_path), type(audio_path), type(output_path)) == (str, str, str):
@@ -25,29 +39,122 @@ class BLMerger():
         else:
             raise ValueError("All inputs must be either lists or strings.")
         
-    def run(self):
+    def run(self, cleanup=False):
         if (type(self.video_path), type(self.audio_path), type(self.output_path)) == (list, list, list):
             if len(self.video_path) == len(self.audio_path) == len(self.output_path):
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    futures = [executor.submit(self.merge, video, audio, output) for video, audio, output in zip(self.video_path, self.audio_path, self.output_path)]
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = [executor.submit(self.merge, video, audio, output, cleanup) for video, audio, output in zip(self.video_path, self.audio_path, self.output_path)]
                     p_bar = tqdm(total=len(futures), desc="Merging videos and audios")
                     for future in concurrent.futures.as_completed(futures):
                         p_bar.update(1)
                         p_bar.set_postfix_str(f"Completed: {future.result()}")
+                    p_bar.close()
             else:
                 raise ValueError("All input lists must have the same length.")
         elif (type(self.video_path), type(self.audio_path), type(self.output_path)) == (str, str, str):
-            self.merge(self.video_path, self.audio_path, self.output_path)
+            self.merge(self.video_path, self.audio_path, self.output_path, cleanup)
         else:
             raise ValueError("All inputs must be either lists or strings.")
         
-    def merge(self, video_path, audio_path, output_path):
-        subprocess.Popen(
-            [self.ffmpeg_path, "-i", video_path, "-i", audio_path, "-c:v", "copy", "-c:a", "copy", output_path, "-y"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True
-        )
+    def start(self):
+        """启动流水线合并阶段，之后可以随时 submit 已下载完成的音视频"""
+        with self._lock:
+            self._users += 1
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+                self._futures = []
+        
+    def submit(self, video_path, audio_path, output_path, cleanup=True, offset=0):
+        with self._lock:
+            if self._executor is None:
+                raise RuntimeError("Merger is not started.")
+            future = self._executor.submit(self.merge, video_path, audio_path, output_path, cleanup, offset)
+            self._futures.append(future)
+        self._update_depth()
+        # 合并完成后队列深度随之回落
+        future.add_done_callback(lambda _: self._update_depth())
+        return future
+        
+    def _update_depth(self):
+        with self._lock:
+            self.metrics.set('merge_queue_depth', sum(1 for f in self._futures if not f.done()))
+        
+    def join(self, futures=None):
+        """等待合并完成，返回各任务的输出路径，失败的为 None；futures 为 None 时等待所有已提交的合并"""
+        with self._lock:
+            if self._executor is None:
+                return []
+            if futures is None:
+                futures = list(self._futures)
+        results = [future.result() for future in concurrent.futures.as_completed(futures)]
+        with self._lock:
+            self._futures = [f for f in self._futures if f not in futures]
+            self._users = max(0, self._users - 1)
+            executor = self._executor if self._users == 0 else None
+            if executor is not None:
+                self._executor, self._futures = None, []
+        if executor is not None:
+            executor.shutdown()
+        return results
+        
+    @staticmethod
+    def supports_pipe_mux():
+        # 需要通过 pass_fds 把两个管道交给 ffmpeg，仅 POSIX 可用
+        return os.name == 'posix'
+        
+    def open_pipe_mux(self, output_path):
+        """启动从两个管道读取视频和音频的 ffmpeg 进程，返回进程及两个写端"""
+        video_read, video_write = os.pipe()
+        audio_read, audio_write = os.pipe()
+        try:
+            process = subprocess.Popen(
+                [self.ffmpeg_path, "-loglevel", "error", "-i", f"pipe:{video_read}", "-i", f"pipe:{audio_read}",
+                 "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "copy", "-f", "mp4", output_path, "-y"],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                pass_fds=(video_read, audio_read),
+            )
+        except OSError:
+            for fd in (video_read, video_write, audio_read, audio_write):
+                os.close(fd)
+            raise
+        os.close(video_read)
+        os.close(audio_read)
+        return process, os.fdopen(video_write, 'wb'), os.fdopen(audio_write, 'wb')
+        
+    def merge(self, video_path, audio_path, output_path, cleanup=False, offset=0):
+        # offset 为音频相对视频的起始时间（秒）；ffmpeg 把每个输入各自归零，
+        # 只截取了片段的音视频起点不同，需要把较晚的一方推后才能保持同步
+        video_args = ["-itsoffset", f"{-offset:.6f}"] if offset < 0 else []
+        audio_args = ["-itsoffset", f"{offset:.6f}"] if offset > 0 else []
+        # 先写入临时文件，失败时不会留下被当作已完成的半成品
+        temp_path = f"{output_path}.tmp"
+        start_time = time.time()
+        try:
+            process = subprocess.run(
+                [self.ffmpeg_path, *video_args, "-i", video_path, *audio_args, "-i", audio_path, "-c:v", "copy", "-c:a", "copy", "-f", "mp4", temp_path, "-y"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as e:
+            self.logger.error(f"Failed to start ffmpeg for {os.path.basename(output_path)}: {e}")
+            return None
+        self.metrics.observe('merge_seconds', time.time() - start_time)
+        if process.returncode != 0:
+            self.metrics.add('merges_total', result='failed')
+            error = process.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            self.logger.error(f"Merging failed {os.path.basename(output_path)} (exit {process.returncode}): {error[-1] if error else ''}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        os.replace(temp_path, output_path)
+        self.metrics.add('merges_total', result='ok')
+        # 仅在合并成功后删除输入文件
+        if cleanup:
+            os.remove(video_path)
+            os.remove(audio_path)
+        return output_path
         
 if __name__ == "__main__":
     video_path = "downloads/video.mp4"
@@ -55,5 +162,6 @@ if __name__ == "__main__":
     output_path = "downloads/output.mp4"
     
     # Example usage
-    merger = BLMerger(video_path, audio_path, output_path)
+    merger = BLMerger()
+    merger.add(video_path, audio_path, output_path)
     merger.run()
\ No newline at end of file
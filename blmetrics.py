@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import threading
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """进程的峰值常驻内存（字节），不支持的平台返回 0"""
+    if resource is None:
+        return 0
+    # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class BLMetrics():
+    """线程分片的指标：写入只修改当前线程自己的字典，读取时再汇总"""
+    SAMPLE_LIMIT = 2048
+
+    def __init__(self):
+        self.started = time.time()
+        self.gauges = {}
+        self._shards = []
+        self._retired = {'counters': {}, 'samples': {}}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {'counters': {}, 'samples': {}}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _collect(self):
+        """返回所有分片；已退出线程的分片并入 retired，避免线程池反复创建线程时分片无限增加"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                    continue
+                for key, value in shard['counters'].items():
+                    self._retired['counters'][key] = self._retired['counters'].get(key, 0) + value
+                for key, values in shard['samples'].items():
+                    retired = self._retired['samples'].setdefault(key, [])
+                    retired.extend(values)
+                    del retired[:max(0, len(retired) - self.SAMPLE_LIMIT)]
+            self._shards = alive
+            retired = {
+                'counters': dict(self._retired['counters']),
+                'samples': {key: list(values) for key, values in self._retired['samples'].items()},
+            }
+        return [shard for _, shard in alive] + [retired]
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def add(self, name, value=1, **labels):
+        counters = self._shard()['counters']
+        key = self._key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        samples = self._shard()['samples']
+        key = self._key(name, labels)
+        values = samples.get(key)
+        if values is None:
+            values = samples[key] = []
+        values.append(value)
+        # 只保留最近的样本，避免长时间运行时无限增长
+        if len(values) > self.SAMPLE_LIMIT:
+            del values[:len(values) - self.SAMPLE_LIMIT]
+
+    def set(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    def counter(self, name, **labels):
+        key = self._key(name, labels)
+        return sum(shard['counters'].get(key, 0) for shard in self._collect())
+
+    @staticmethod
+    def _quantile(values, q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def snapshot(self):
+        counters, samples = {}, {}
+        for shard in self._collect():
+            for key, value in list(shard['counters'].items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, values in list(shard['samples'].items()):
+                samples.setdefault(key, []).extend(list(values))
+        summaries = {}
+        for key, values in samples.items():
+            values.sort()
+            if values:
+                summaries[key] = {
+                    'count': len(values), 'sum': sum(values), 'min': values[0], 'max': values[-1],
+                    'p50': self._quantile(values, 0.5), 'p99': self._quantile(values, 0.99),
+                }
+        return {
+            'uptime': time.time() - self.started,
+            'counters': counters,
+            'gauges': dict(self.gauges),
+            'summaries': summaries,
+        }
+
+    @staticmethod
+    def _name(key):
+        name, labels = key
+        if not labels:
+            return name
+        return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+    def to_dict(self):
+        snapshot = self.snapshot()
+        return {
+            'uptime': snapshot['uptime'],
+            'counters': {self._name(k): v for k, v in snapshot['counters'].items()},
+            'gauges': {self._name(k): v for k, v in snapshot['gauges'].items()},
+            'summaries': {self._name(k): v for k, v in snapshot['summaries'].items()},
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=4)
+
+    def to_prometheus(self, prefix='bldownloader_'):
+        snapshot = self.snapshot()
+        lines = [f'{prefix}uptime_seconds {snapshot["uptime"]:.3f}']
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            lines.append(f'{prefix}{self._name((name, labels))} {value}')
+        for (name, labels), value in sorted(snapshot['gauges'].items()):
+            lines.append(f'{prefix}{self._name((name, labels))} {value}')
+        for (name, labels), summary in sorted(snapshot['summaries'].items()):
+            for quantile in ('p50', 'p99'):
+                quantile_labels = labels + (('quantile', '0.5' if quantile == 'p50' else '0.99'),)
+                lines.append(f'{prefix}{self._name((name, quantile_labels))} {summary[quantile]}')
+            lines.append(f'{prefix}{self._name((name + "_sum", labels))} {summary["sum"]}')
+            lines.append(f'{prefix}{self._name((name + "_count", labels))} {summary["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+class BLStatsWriter():
+    """定期把指标快照写入文件，.prom 后缀写 Prometheus 文本格式，其余写 JSON"""
+
+    def __init__(self, metrics, path, interval=10):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        data = self.metrics.to_prometheus() if self.path.endswith('.prom') else self.metrics.to_json()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self._stop.set()
+        self.write()
+
+
+class BLProgress():
+    """进度计数：update 无锁写入线程分片，由单独的渲染线程按固定频率刷新显示"""
+    MODES = ('tqdm', 'headless', 'none')
+
+    def __init__(self, desc, total=0, initial=0, mode='tqdm', interval=0.5):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown progress mode: {mode}")
+        self.desc = desc
+        self.total = total
+        self.mode = mode
+        self.interval = interval
+        self._counts = BLMetrics()
+        self._key = 'bytes'
+        self._initial = initial
+        self._bar = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def n(self):
+        return self._initial + self._counts.counter(self._key)
+
+    def update(self, n):
+        self._counts.add(self._key, n)
+
+    def _render(self):
+        if self.mode == 'tqdm':
+            self._bar.total = self.total
+            self._bar.update(self.n - self._bar.n)
+        elif self.mode == 'headless':
+            elapsed = time.time() - self._started
+            rate = (self.n - self._initial) / elapsed if elapsed > 0 else 0
+            sys.stderr.write(f"[{self.desc}] {self.n / 1024 / 1024:.1f}/{self.total / 1024 / 1024:.1f} MB {rate / 1024 / 1024:.2f} MB/s\n")
+            sys.stderr.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._render()
+
+    def __enter__(self):
+        self._started = time.time()
+        if self.mode == 'tqdm':
+            self._bar = tqdm(desc=self.desc, total=self.total, initial=self._initial, unit='B', unit_scale=True, unit_divisor=1024)
+        if self.mode != 'none':
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.mode != 'none':
+            self._render()
+        if self._bar is not None:
+            self._bar.close()
+            self._bar = None
@@ -0,0 +1,254 @@
+import os
+import time
+import random
+import sqlite3
+import multiprocessing
+
+
+class BLJobQueue():
+    PENDING = 'pending'
+    FETCHING = 'fetching'
+    DOWNLOADING = 'downloading'
+    MERGING = 'merging'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    ACTIVE_STATES = (FETCHING, DOWNLOADING, MERGING)
+
+    def __init__(self, db_path, max_attempts=5, backoff=30):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        # 每个进程各自持有连接，写事务由 SQLite 的文件锁串行化
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'bvid TEXT PRIMARY KEY, state TEXT, attempts INTEGER DEFAULT 0, next_attempt_at REAL DEFAULT 0, '
+            'error TEXT, worker TEXT, created_at REAL, updated_at REAL, weight REAL DEFAULT 1, rate REAL DEFAULT 0)'
+        )
+        # 旧版本创建的队列没有带宽分配的列
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column, definition in (('weight', 'REAL DEFAULT 1'), ('rate', 'REAL DEFAULT 0')):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+
+    def add(self, bvids, reset=False, weight=None, rate=None):
+        """加入新任务，已存在的任务（包括已完成的）保持原状态；reset 时已失败或已取消的任务重新排队；
+        weight 和 rate 为任务的带宽权重和上限，给出时同样更新已存在的任务"""
+        now = time.time()
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            cursor = self._conn.executemany(
+                'INSERT OR IGNORE INTO jobs (bvid, state, created_at, updated_at, weight, rate) VALUES (?, ?, ?, ?, ?, ?)',
+                [(bvid, self.PENDING, now, now, 1 if weight is None else weight, rate or 0) for bvid in bvids]
+            )
+            added = cursor.rowcount
+            self._update_limits(bvids, weight, rate)
+            if reset:
+                self._conn.executemany(
+                    'UPDATE jobs SET state = ?, attempts = 0, next_attempt_at = 0, error = NULL, updated_at = ? WHERE bvid = ? AND state IN (?, ?)',
+                    [(self.PENDING, now, bvid, self.FAILED, self.CANCELLED) for bvid in bvids]
+                )
+        return added
+
+    def update_job(self, bvid, weight=None, rate=None):
+        """修改任务的带宽权重或上限，任务不存在时返回 False"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            if self._conn.execute('SELECT 1 FROM jobs WHERE bvid = ?', (bvid,)).fetchone() is None:
+                return False
+            self._update_limits([bvid], weight, rate)
+        return True
+
+    def _update_limits(self, bvids, weight, rate):
+        # 在事务内调用
+        for column, value in (('weight', weight), ('rate', rate)):
+            if value is not None:
+                self._conn.executemany(
+                    f'UPDATE jobs SET {column} = ? WHERE bvid = ?',
+                    [(value, bvid) for bvid in bvids]
+                )
+
+    def recover(self):
+        """将上次运行中断时仍处于进行中的任务重新置为待处理"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.execute(
+                f'UPDATE jobs SET state = ?, worker = NULL, updated_at = ? WHERE state IN ({",".join("?" * len(self.ACTIVE_STATES))})',
+                (self.PENDING, time.time(), *self.ACTIVE_STATES)
+            )
+
+    def claim(self, worker):
+        """原子地领取一个到期的待处理任务，没有则返回 None"""
+        now = time.time()
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            row = self._conn.execute(
+                'SELECT bvid FROM jobs WHERE state = ? AND next_attempt_at <= ? ORDER BY next_attempt_at, created_at LIMIT 1',
+                (self.PENDING, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, worker = ?, updated_at = ? WHERE bvid = ?',
+                (self.FETCHING, worker, now, row[0])
+            )
+        return row[0]
+
+    def set_state(self, bvid, state, error=None):
+        with self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE bvid = ?',
+                (state, error, time.time(), bvid)
+            )
+
+    def fail(self, bvid, error):
+        """记录一次失败：未超过重试次数时按指数退避（带抖动）重新排队"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            row = self._conn.execute('SELECT attempts FROM jobs WHERE bvid = ?', (bvid,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            now = time.time()
+            if attempts >= self.max_attempts:
+                state, next_attempt_at = self.FAILED, now
+            else:
+                delay = self.backoff * 2 ** (attempts - 1)
+                state, next_attempt_at = self.PENDING, now + delay * random.uniform(0.5, 1.5)
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, attempts = ?, next_attempt_at = ?, error = ?, worker = NULL, updated_at = ? WHERE bvid = ?',
+                (state, attempts, next_attempt_at, error, now, bvid)
+            )
+        return state
+
+    def fail_worker(self, worker, error):
+        """工作进程异常退出时，把它领取的进行中任务记为一次失败，返回这些任务"""
+        rows = self._conn.execute(
+            f'SELECT bvid FROM jobs WHERE worker = ? AND state IN ({",".join("?" * len(self.ACTIVE_STATES))})',
+            (worker, *self.ACTIVE_STATES)
+        ).fetchall()
+        for (bvid,) in rows:
+            self.fail(bvid, error)
+        return [bvid for (bvid,) in rows]
+
+    def cancel(self, bvid):
+        """取消尚未结束的任务，返回取消前的状态；任务不存在或已结束时返回 None"""
+        with self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            row = self._conn.execute('SELECT state FROM jobs WHERE bvid = ?', (bvid,)).fetchone()
+            if row is None or row[0] in (self.DONE, self.FAILED, self.CANCELLED):
+                return None
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, worker = NULL, updated_at = ? WHERE bvid = ?',
+                (self.CANCELLED, time.time(), bvid)
+            )
+        return row[0]
+
+    def get(self, bvid):
+        cursor = self._conn.execute('SELECT * FROM jobs WHERE bvid = ?', (bvid,))
+        row = cursor.fetchone()
+        return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    def list(self, limit=100):
+        cursor = self._conn.execute('SELECT * FROM jobs ORDER BY updated_at DESC LIMIT ?', (limit,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def counts(self):
+        rows = self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return dict(rows)
+
+    def next_wakeup(self):
+        """下一个待处理任务可以开始的时间，没有待处理任务时返回 None"""
+        row = self._conn.execute('SELECT MIN(next_attempt_at) FROM jobs WHERE state = ?', (self.PENDING,)).fetchone()
+        return row[0]
+
+    def has_work(self):
+        counts = self.counts()
+        return any(counts.get(state) for state in (self.PENDING,) + self.ACTIVE_STATES)
+
+    def close(self):
+        self._conn.close()
+
+
+def _batch_worker(db_path, queue_kwargs, downloader_kwargs, download_kwargs, download_path, rate_limits=(0, 0), global_bucket=None):
+    # 子进程中导入，避免父进程在 spawn 模式下重复初始化
+    from bldownloader import BLDownloader
+    from bllimit import BLBandwidthLimiter
+
+    worker = f"{os.getpid()}"
+    queue = BLJobQueue(db_path, **queue_kwargs)
+    downloader = BLDownloader(**downloader_kwargs, limiter=BLBandwidthLimiter(*rate_limits, global_bucket=global_bucket))
+    # 复用父进程登录后导出的 cookie，不再单独登录
+    downloader._load_cookie()
+    while True:
+        bvid = queue.claim(worker)
+        if bvid is None:
+            if not queue.has_work():
+                break
+            wakeup = queue.next_wakeup()
+            time.sleep(min(max((wakeup or 0) - time.time(), 1), 30))
+            continue
+        downloader.logger.info(f"[{worker}] Processing {bvid}")
+        job = queue.get(bvid)
+        try:
+            success = downloader.download_bvid(
+                bvid,
+                save_path=os.path.join(download_path, bvid),
+                on_stage=lambda state: queue.set_state(bvid, state),
+                weight=job['weight'],
+                rate=job['rate'],
+                **download_kwargs
+            )
+            error = None if success else 'download or merge failed'
+        except Exception as e:
+            success, error = False, str(e)
+        if success:
+            queue.set_state(bvid, BLJobQueue.DONE)
+            downloader.logger.info(f"[{worker}] Finished {bvid}")
+        else:
+            state = queue.fail(bvid, error)
+            downloader.logger.warning(f"[{worker}] {bvid} failed ({error}), now {state}")
+    queue.close()
+
+
+def run_batch(db_path, bvids, processes, downloader_kwargs, download_kwargs, download_path, max_attempts=5, backoff=30, rate_limit=0, host_rate_limit=0, weight=None, job_rate=None):
+    """将 bvids 加入持久化队列，并用多个进程处理直到队列中没有可执行的任务"""
+    from bllimit import SharedTokenBucket
+
+    queue = BLJobQueue(db_path, max_attempts, backoff)
+    queue.recover()
+    queue.add(bvids, weight=weight, rate=job_rate)
+    queue_kwargs = {'max_attempts': max_attempts, 'backoff': backoff}
+    processes = max(1, processes)
+    # 总上限放在共享内存中由各工作进程共用；单主机上限仍平均分给各个进程
+    global_bucket = SharedTokenBucket(rate_limit)
+    rate_limits = (rate_limit, host_rate_limit / processes)
+
+    def spawn():
+        process = multiprocessing.Process(
+            target=_batch_worker,
+            args=(db_path, queue_kwargs, downloader_kwargs, download_kwargs, download_path, rate_limits, global_bucket),
+        )
+        process.start()
+        return process
+
+    workers = [spawn() for _ in range(processes)]
+    while workers:
+        for worker in list(workers):
+            worker.join(1)
+            if worker.exitcode is None:
+                continue
+            workers.remove(worker)
+            if worker.exitcode != 0:
+                # 被 OOM 或信号杀死的进程不会更新自己的任务，其余进程会一直等待这些任务结束
+                failed = queue.fail_worker(str(worker.pid), f"worker exited with code {worker.exitcode}")
+                if failed:
+                    print(f"工作进程 {worker.pid} 异常退出 ({worker.exitcode})，任务重新排队: {', '.join(failed)}")
+                # 失败次数达到上限后任务不再排队，补充进程不会无限重启
+                if queue.has_work():
+                    workers.append(spawn())
+    counts = queue.counts()
+    queue.close()
+    return counts
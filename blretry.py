@@ -0,0 +1,104 @@
+import time
+import random
+import requests
+import http.client
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs
+
+
+EXPIRED = 'expired'
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+
+class StreamMismatch(IOError):
+    """重新解析后的地址指向了大小不同的文件，继续写入会损坏已下载的部分"""
+
+
+class BLRetryPolicy():
+    """把传输错误分为地址过期、被限流、临时错误和致命错误，并给出带抖动的指数退避时间"""
+    BASE_DELAY = 0.5
+    MAX_DELAY = 30
+    # 服务端 Retry-After 的上限，避免单个响应让任务停顿过久
+    MAX_RETRY_AFTER = 120
+    # 流地址 deadline 之前提前刷新的时间
+    EXPIRY_MARGIN = 30
+    EXPIRED_STATUS = (403, 410)
+    THROTTLED_STATUS = (412, 429, 503)
+
+    def __init__(self, base_delay=None, max_delay=None):
+        self.base_delay = base_delay if base_delay is not None else self.BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else self.MAX_DELAY
+
+    @staticmethod
+    def deadline(url):
+        """签名地址中的 deadline 参数（Unix 时间戳），没有则返回 None"""
+        deadline = parse_qs(urlparse(url).query).get('deadline')
+        return int(deadline[0]) if deadline and deadline[0].isdigit() else None
+
+    def expired(self, url):
+        deadline = self.deadline(url)
+        return deadline is not None and deadline - self.EXPIRY_MARGIN < time.time()
+
+    @staticmethod
+    def _response(error):
+        # 探测失败时真正的 HTTP 错误可能被包装在 __cause__ 中
+        while error is not None:
+            response = getattr(error, 'response', None)
+            if response is not None:
+                return response
+            error = error.__cause__
+        return None
+
+    def classify(self, error, url=None):
+        response = self._response(error)
+        if response is not None and response.status_code >= 400:
+            status = response.status_code
+            if status in self.EXPIRED_STATUS:
+                return EXPIRED
+            if status in self.THROTTLED_STATUS:
+                return THROTTLED
+            if status >= 500 or status == 408:
+                return TRANSIENT
+            # 地址本身已过期时，其余 4xx 也按过期处理，重新解析后再试
+            return EXPIRED if url is not None and self.expired(url) else FATAL
+        if isinstance(error, StreamMismatch):
+            return FATAL
+        # 直接从套接字读取时，连接中断和超时不会被 requests 包装
+        if isinstance(error, (requests.RequestException, ConnectionError, TimeoutError, http.client.HTTPException)):
+            return TRANSIENT
+        # 带 errno 的 OSError 来自本地文件（如磁盘已满），重试无济于事
+        if isinstance(error, OSError) and error.errno is not None:
+            return FATAL
+        return TRANSIENT
+
+    def retry_after(self, error):
+        response = self._response(error)
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0), self.MAX_RETRY_AFTER)
+
+    def delay(self, attempt, error=None, kind=None):
+        """第 attempt 次失败（从 0 开始）后的等待时间"""
+        kind = kind or (self.classify(error) if error is not None else TRANSIENT)
+        if kind == EXPIRED:
+            # 已换用新地址，无需等待
+            return 0
+        if kind == THROTTLED and error is not None:
+            retry_after = self.retry_after(error)
+            if retry_after is not None:
+                return retry_after
+        # 等量抖动：一半固定、一半随机，避免大量分段同时重试
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        if kind == THROTTLED:
+            backoff = min(self.max_delay, backoff * 2)
+        return backoff / 2 + random.uniform(0, backoff / 2)
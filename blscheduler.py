@@ -0,0 +1,326 @@
+import os
+import time
+import threading
+from blmetrics import BLProgress
+from bljournal import BLJournal
+
+
+class Segment:
+    """正在下载的区间，end 可被空闲线程缩短以窃取后半部分"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return self.end - self.pos + 1
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return (self.pos - self.start) / elapsed if elapsed > 0 else 0
+
+
+class TransferStream:
+    """调度器中的一个待下载文件，探测后被切分为若干分段"""
+
+    def __init__(self, url, file_path, segment_size, use_segments=True, on_done=None, job=None, clip=None):
+        self.url = url
+        self.job = job
+        # (初始化段与 sidx 的字节区间, 起始秒, 结束秒)：只下载覆盖该时间区间的分片
+        self.clip = clip
+        self.shift = 0
+        self.source_size = None
+        self.window = None
+        self.file_path = file_path
+        self.segment_size = segment_size
+        self.use_segments = use_segments
+        self.on_done = on_done
+        self.probed = False
+        self.direct = False
+        self.total_size = 0
+        self.journal = None
+        self.pending = []
+        self.pending_bytes = 0
+        self.inflight = 0
+        self.inflight_bytes = 0
+        self.active = []
+        self.failed = False
+        self.finished = False
+        self._positions = 0
+
+    def remaining(self):
+        return self.pending_bytes + self.inflight_bytes
+
+    def next_position(self):
+        self._positions += 1
+        return self._positions - 1
+
+
+class TransferScheduler:
+    """跨剧集的全局传输调度器：固定 N 个工作线程，优先完成剩余字节最少的流"""
+    MIN_SPLIT = 2*1024*1024
+    ADAPT_INTERVAL = 2
+
+    def __init__(self, downloader, max_workers=None, adaptive=False, cancel=None):
+        self.downloader = downloader
+        # 外部设置该事件即停止调度，已下载的部分保留在日志中以便续传
+        self.cancel_event = cancel
+        self.cancelled = False
+        self.max_workers = max_workers if max_workers else downloader.max_workers
+        self.adaptive = adaptive
+        # 自适应模式下从较低并发起步，按 AIMD 在 [1, max_workers] 内调整
+        self.concurrency = min(2, self.max_workers) if adaptive else self.max_workers
+        self.streams = []
+        self._cond = threading.Condition()
+        self._pbar = None
+        self._resumed = 0
+        self._finished = threading.Event()
+        self.bytes_done = 0
+        self.elapsed = 0
+
+    def add(self, url, file_path, segment_size=10*1024*1024, use_segments=True, on_done=None, job=None, clip=None):
+        stream = TransferStream(url, file_path, segment_size, use_segments, on_done, job, clip)
+        with self._cond:
+            self.streams.append(stream)
+            self._cond.notify()
+        return stream
+
+    def _next_task(self, index):
+        """选择下一个任务：优先剩余最少的流的分段，其次探测新的流，最后窃取慢分段"""
+        with self._cond:
+            while True:
+                if self.cancelled:
+                    for stream in self.streams:
+                        if not stream.finished and stream.inflight == 0:
+                            self._finish(stream)
+                if all(st.finished for st in self.streams):
+                    return None, None, None
+                if self.cancelled:
+                    self._cond.wait(1)
+                    continue
+                # 编号超出当前并发上限的线程暂停等待
+                if index >= self.concurrency:
+                    self._cond.wait(1)
+                    continue
+                candidates = [st for st in self.streams if st.probed and st.pending]
+                if candidates:
+                    stream = min(candidates, key=lambda st: st.remaining())
+                    start, end = stream.pending.pop(0)
+                    size = end - start + 1
+                    stream.pending_bytes -= size
+                    stream.inflight += 1
+                    stream.inflight_bytes += size
+                    segment = Segment(start, end)
+                    stream.active.append(segment)
+                    self._report()
+                    return 'segment', stream, segment
+                for stream in self.streams:
+                    if not stream.probed and stream.inflight == 0:
+                        stream.inflight += 1
+                        return 'probe', stream, None
+                if self.adaptive:
+                    stream, segment = self._steal()
+                    if segment is not None:
+                        self.downloader.metrics.add('segments_stolen_total')
+                        self._report()
+                        return 'segment', stream, segment
+                self._cond.wait(1)
+
+    def _report(self):
+        metrics = self.downloader.metrics
+        metrics.set('scheduler_pending_segments', sum(len(st.pending) for st in self.streams))
+        metrics.set('scheduler_active_transfers', sum(len(st.active) for st in self.streams))
+        metrics.set('scheduler_unprobed_streams', sum(1 for st in self.streams if not st.probed))
+        metrics.set('scheduler_concurrency', self.concurrency)
+
+    def _report_progress(self, job):
+        """把任务的完成比例告知限速器，接近完成的任务分得更多带宽"""
+        streams = [st for st in self.streams if st.job == job]
+        # 还有未探测的流时总大小未知，不提高优先级
+        if job is None or not all(st.probed for st in streams):
+            return
+        total = sum(st.total_size for st in streams)
+        if total:
+            self.downloader.limiter.set_progress(job, 1 - sum(st.remaining() for st in streams) / total)
+
+    def _steal(self):
+        """拆分预计最晚完成的分段，返回其后半部分"""
+        best, best_eta = (None, None), 0
+        for stream in self.streams:
+            for segment in stream.active:
+                remaining = segment.remaining()
+                if remaining < 2 * self.MIN_SPLIT:
+                    continue
+                eta = remaining / max(segment.rate(), 1)
+                if eta > best_eta:
+                    best, best_eta = (stream, segment), eta
+        stream, victim = best
+        if victim is None:
+            return None, None
+        with victim.lock:
+            if victim.remaining() < 2 * self.MIN_SPLIT:
+                return None, None
+            mid = victim.pos + victim.remaining() // 2
+            segment = Segment(mid, victim.end)
+            victim.end = mid - 1
+        # 拆分前后在途字节总数不变，只增加在途分段数
+        stream.inflight += 1
+        stream.active.append(segment)
+        return stream, segment
+
+    def _probe(self, stream):
+        journal = None
+        if stream.clip is not None:
+            # 片段下载：本地文件只含初始化段和所需分片，分段区间按本地偏移切分
+            journal, stream.shift, stream.source_size, stream.url, stream.window = self.downloader._probe_clip(stream.url, stream.file_path, *stream.clip)
+            total_size = journal.total_size
+        else:
+            total_size, support_range, stream.url = self.downloader._probe(stream.url)
+            if support_range and total_size > 0:
+                journal = BLJournal.open(stream.file_path, total_size)
+        with self._cond:
+            stream.probed = True
+            stream.inflight -= 1
+            if journal is None:
+                # 不支持断点续传，整个文件作为一个任务直接下载
+                stream.direct = True
+                stream.pending = [(0, 0)]
+                stream.pending_bytes = 1
+            else:
+                segment_size = stream.segment_size
+                if total_size < segment_size or not stream.use_segments:
+                    segment_size = total_size
+                stream.total_size = total_size
+                stream.journal = journal
+                stream.pending = journal.missing(segment_size)
+                stream.pending_bytes = sum(e - s + 1 for s, e in stream.pending)
+                resumed = journal.done_size()
+                self._resumed += resumed
+                with self.downloader._lock:
+                    self._pbar.total += total_size
+                    self._pbar.update(resumed)
+            if not stream.pending:
+                self._finish(stream)
+            self._cond.notify_all()
+
+    def _transfer(self, stream, segment):
+        if stream.direct:
+            success = self.downloader._direct_download(stream.url, stream.file_path, stream.job, self._pbar) is not None
+        else:
+            success, _ = self.downloader._download_segment(
+                stream.url, stream.file_path, segment.start, segment.end, stream.next_position(), self._pbar, stream.journal, segment, stream.job,
+                stream.shift, stream.source_size
+            )
+        with self._cond:
+            stream.inflight -= 1
+            stream.inflight_bytes -= segment.end - segment.start + 1
+            stream.active.remove(segment)
+            if not success:
+                stream.failed = True
+            if not stream.pending and stream.inflight == 0:
+                self._finish(stream)
+            self._report()
+            self._report_progress(stream.job)
+            self._cond.notify_all()
+
+    def _finish(self, stream):
+        stream.finished = True
+        if stream.failed:
+            print(f"部分分段下载失败: {stream.file_path}")
+        else:
+            if stream.journal is not None:
+                stream.journal.remove()
+        if stream.on_done is not None:
+            try:
+                stream.on_done(stream, not stream.failed)
+            except Exception as e:
+                print(f"完成回调失败 {os.path.basename(stream.file_path)}: {e}")
+
+    def _worker(self, index):
+        while True:
+            kind, stream, segment = self._next_task(index)
+            if kind is None:
+                return
+            try:
+                if kind == 'probe':
+                    self._probe(stream)
+                else:
+                    self._transfer(stream, segment)
+            except Exception as e:
+                print(f"传输任务失败 {os.path.basename(stream.file_path)}: {e}")
+                with self._cond:
+                    stream.probed = True
+                    stream.failed = True
+                    stream.pending = []
+                    stream.pending_bytes = 0
+                    stream.inflight -= 1
+                    if segment in stream.active:
+                        stream.active.remove(segment)
+                    if stream.inflight == 0 and not stream.finished:
+                        self._finish(stream)
+                    self._cond.notify_all()
+
+    def cancel(self):
+        """丢弃待下载的分段，并把在途分段截断到当前位置，使其在下一个数据块后结束"""
+        with self._cond:
+            self.cancelled = True
+            for stream in self.streams:
+                stream.failed = True
+                stream.pending = []
+                stream.pending_bytes = 0
+                for segment in stream.active:
+                    with segment.lock:
+                        segment.end = segment.pos - 1
+            self._cond.notify_all()
+
+    def _watch_cancel(self):
+        while not self._finished.wait(0.2):
+            if self.cancel_event.is_set():
+                self.cancel()
+                return
+
+    def _adapt(self):
+        """AIMD：无错误且单连接吞吐未明显下降时并发 +1，出现错误或吞吐骤降时减半"""
+        last_bytes, last_errors = self._pbar.n, self.downloader.errors
+        best_per_conn = 0
+        while not self._finished.wait(self.ADAPT_INTERVAL):
+            current_bytes, current_errors = self._pbar.n, self.downloader.errors
+            with self._cond:
+                active = max(1, sum(len(st.active) for st in self.streams))
+                per_conn = (current_bytes - last_bytes) / self.ADAPT_INTERVAL / active
+                best_per_conn = max(best_per_conn, per_conn)
+                if current_errors > last_errors or per_conn < best_per_conn / 2:
+                    self.concurrency = max(1, self.concurrency // 2)
+                    best_per_conn = per_conn
+                elif self.concurrency < self.max_workers:
+                    self.concurrency += 1
+                self._cond.notify_all()
+            last_bytes, last_errors = current_bytes, current_errors
+
+    def run(self):
+        """运行直到所有流完成，返回是否全部成功"""
+        start_time = time.time()
+        self._finished.clear()
+        with BLProgress("Downloading streams", mode=self.downloader.progress) as pbar:
+            self._pbar = pbar
+            workers = [threading.Thread(target=self._worker, args=(i,), daemon=True) for i in range(self.max_workers)]
+            if self.adaptive:
+                controller = threading.Thread(target=self._adapt, daemon=True)
+                controller.start()
+            if self.cancel_event is not None:
+                threading.Thread(target=self._watch_cancel, daemon=True).start()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self._finished.set()
+            # 续传前已完成的字节不计入本次吞吐量
+            self.bytes_done = pbar.n - self._resumed
+        self.elapsed = time.time() - start_time
+        return all(not st.failed for st in self.streams)
+
+    def throughput(self):
+        return self.bytes_done / self.elapsed if self.elapsed > 0 else 0
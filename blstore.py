@@ -0,0 +1,137 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+
+class BLMediaStore():
+    """按内容寻址的本地媒体仓库：对象以 sha256 命名，流标识映射到对象，复用前校验完整性"""
+    HASH_BLOCK = 1024*1024
+
+    def __init__(self, root, quota=0):
+        self.root = root
+        # 仓库占用的磁盘上限（字节），0 表示不限制
+        self.quota = quota
+        self.objects_path = os.path.join(root, 'objects')
+        os.makedirs(self.objects_path, exist_ok=True)
+        self._lock = threading.Lock()
+        # 批量模式下多个进程共用同一个索引
+        self._conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False, timeout=60)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS objects (sha256 TEXT PRIMARY KEY, size INTEGER, last_used REAL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS streams (key TEXT PRIMARY KEY, sha256 TEXT)')
+        # 配额可能比上次运行时更小
+        if quota:
+            self.evict(quota)
+
+    @staticmethod
+    def key(*parts):
+        return '/'.join(str(part) for part in parts)
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_path, sha256[:2], sha256)
+
+    def _hash(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(self.HASH_BLOCK)
+                if not block:
+                    break
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _link(src, dst):
+        """优先硬链接（不占额外空间），跨文件系统等情况下退回复制"""
+        tmp_path = f"{dst}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def get(self, key, verify=True):
+        """返回 key 对应的对象路径；对象缺失或校验失败时将其移出仓库并返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT objects.sha256, objects.size FROM streams JOIN objects ON streams.sha256 = objects.sha256 WHERE streams.key = ?',
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        sha256, size = row
+        path = self._object_path(sha256)
+        try:
+            intact = os.path.getsize(path) == size and (not verify or self._hash(path) == sha256)
+        except OSError:
+            intact = False
+        if not intact:
+            # 硬链接出去的文件被原地修改也会改到仓库中的对象
+            self._remove(sha256)
+            return None
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE objects SET last_used = ? WHERE sha256 = ?', (time.time(), sha256))
+        return path
+
+    def link(self, key, dest_path, verify=True):
+        """把 key 对应的对象放到 dest_path，成功返回 True"""
+        path = self.get(key, verify)
+        if path is None:
+            return False
+        try:
+            self._link(path, dest_path)
+        except OSError:
+            return False
+        return True
+
+    def put(self, key, file_path):
+        """将文件收入仓库并登记 key，内容相同的文件只保存一份；返回 sha256"""
+        sha256 = self._hash(file_path)
+        size = os.path.getsize(file_path)
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._link(file_path, path)
+        with self._lock, self._conn:
+            self._conn.execute('REPLACE INTO objects VALUES (?, ?, ?)', (sha256, size, time.time()))
+            self._conn.execute('REPLACE INTO streams VALUES (?, ?)', (key, sha256))
+        if self.quota:
+            self.evict(self.quota)
+        return sha256
+
+    def _remove(self, sha256):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM streams WHERE sha256 = ?', (sha256,))
+            self._conn.execute('DELETE FROM objects WHERE sha256 = ?', (sha256,))
+        try:
+            os.remove(self._object_path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def usage(self):
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def evict(self, quota):
+        """按最近使用时间淘汰对象，直到总占用不超过 quota；返回释放的字节数"""
+        with self._lock:
+            rows = self._conn.execute('SELECT sha256, size FROM objects ORDER BY last_used').fetchall()
+        total = sum(size for _, size in rows)
+        freed = 0
+        for sha256, size in rows:
+            if total <= quota:
+                break
+            self._remove(sha256)
+            total -= size
+            freed += size
+        return freed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
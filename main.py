@@ -1,5 +1,5 @@
-from bldownloader import BLDownloader
-import argparse, os
+from blclient import BLClient, DEFAULT_ADDRESS
+import argparse, os, sys, json
 
 def parse_args():
     DOWNLOAD_PATH = r"data/downloads"
@@ -7,33 +7,169 @@ def parse_args():
     parser.add_argument("--bvid", "-b", type=str, default=None, help="BVID of the video.")
     parser.add_argument("--use_segments", "-s", action="store_true", default=True, help="Use segmented download.")
     parser.add_argument("--segment_size", "-ss", type=int, default=25*1024*1024, help="Segment size in bytes.")
+    parser.add_argument("--chunk_size", "-cs", type=int, default=1024*1024, help="Read buffer size in bytes for each transfer.")
+    parser.add_argument("--memory_budget", type=int, default=0, help="Upper bound in bytes for all read buffers; transfers wait for a free buffer (0 = one buffer per worker).")
     parser.add_argument("--ffmpeg_path", "-f", type=str, default=None, help="Path to ffmpeg executable.")
     parser.add_argument("--max_workers", "-w", type=int, default=8, help="Number of concurrent workers.")
     parser.add_argument("--timeout", "-t", type=int, default=30, help="Timeout for each download in seconds.")
     parser.add_argument("--retry", "-r", type=int, default=3, help="Number of retries for each download.")
     parser.add_argument("--download_path", "-d", type=str, default=DOWNLOAD_PATH, help="Path to save downloaded files.")
     parser.add_argument("--cache", "-c", action="store_true", default=True, help="Use cached files if available.")
+    parser.add_argument("--adaptive", "-a", action="store_true", default=False, help="Tune concurrency automatically and split slow segments.")
+    parser.add_argument("--no_meta_cache", action="store_true", default=False, help="Do not use the on-disk pagelist/playinfo cache.")
+    parser.add_argument("--no_media_store", action="store_true", default=False, help="Do not reuse or keep finished episodes in the content-addressed media store.")
+    parser.add_argument("--store_quota", type=int, default=0, help="Disk quota of the media store in bytes; least recently used entries are evicted (0 = unlimited).")
+    parser.add_argument("--http2", action="store_true", default=False, help="Fetch pagelist/playinfo over a multiplexed HTTP/2 connection (requires httpx[http2]).")
+    parser.add_argument("--start", type=str, default=None, help="Only download from this time (seconds or [HH:]MM:SS), using the DASH segment index.")
+    parser.add_argument("--end", type=str, default=None, help="Only download up to this time (seconds or [HH:]MM:SS), using the DASH segment index.")
+    parser.add_argument("--direct_mux", "-m", action="store_true", default=False, help="Pipe video and audio straight into ffmpeg without intermediate files.")
+    parser.add_argument("--engine", "-e", type=str, choices=["thread", "async"], default="thread", help="Download engine (async requires aiohttp).")
+    parser.add_argument("--progress", type=str, choices=["tqdm", "headless", "none"], default="tqdm", help="Progress display: tqdm bars, periodic plain-text lines, or nothing.")
+    parser.add_argument("--stats_file", type=str, default=None, help="Periodically write transfer metrics to this file (.prom for Prometheus text, JSON otherwise).")
+    parser.add_argument("--stats_interval", type=int, default=10, help="Seconds between stats file updates.")
+    parser.add_argument("--rate_limit", type=float, default=None, help="Global download cap in bytes/s shared by all transfers (0 = unlimited).")
+    parser.add_argument("--host_rate_limit", type=float, default=None, help="Per-host download cap in bytes/s (0 = unlimited).")
+    parser.add_argument("--weight", type=float, default=None, help="Share of the global cap this job gets relative to other running jobs (default 1).")
+    parser.add_argument("--job_rate", type=float, default=None, help="Download cap in bytes/s for this job alone (0 = unlimited).")
+    parser.add_argument("--batch", type=str, default=None, help="File with one BVID per line ('-' for stdin) to run through the job queue.")
+    parser.add_argument("--processes", "-p", type=int, default=2, help="Number of worker processes in batch mode.")
+    parser.add_argument("--max_attempts", type=int, default=5, help="Attempts per job before it is marked failed in batch mode.")
+    parser.add_argument("--queue_path", type=str, default=r"data/queue/jobs.db", help="Path of the persistent job queue database.")
+    parser.add_argument("--daemon", action="store_true", default=False, help="Stay running and accept jobs over a local JSON API.")
+    parser.add_argument("--daemon_address", type=str, default=DEFAULT_ADDRESS, help="Daemon address: host:port, or unix:/path/to.sock.")
+    parser.add_argument("--daemon_jobs", type=int, default=2, help="Number of jobs the daemon runs at the same time.")
+    parser.add_argument("--no_daemon", action="store_true", default=False, help="Download in this process even if a daemon is running.")
+    parser.add_argument("--status", action="store_true", default=False, help="Show the daemon status, or the job status with --bvid.")
+    parser.add_argument("--list", action="store_true", default=False, help="List the daemon's jobs.")
+    parser.add_argument("--cancel", type=str, default=None, help="Cancel a daemon job by BVID.")
+    parser.add_argument("--stop_daemon", action="store_true", default=False, help="Shut the daemon down.")
+    parser.add_argument("--set_limits", action="store_true", default=False, help="Change the running daemon's --rate_limit/--host_rate_limit, or with --bvid the job's --weight/--job_rate.")
     return parser.parse_args()
 
+def read_bvids(source):
+    f = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    with f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def warn_ignored_settings(daemon_settings, local_settings):
+    """任务按常驻进程的参数执行，本次命令行中与之不同的参数不会生效"""
+    ignored = [f"{name}={value} (daemon: {daemon_settings[name]})" for name, value in local_settings.items()
+               if name in daemon_settings and daemon_settings[name] != value]
+    if ignored:
+        print(f"Warning: the daemon runs jobs with its own settings, ignoring: {', '.join(ignored)}", file=sys.stderr)
+
+def client_command(args):
+    """查询或控制常驻进程，这些命令不导入下载相关的模块"""
+    client = BLClient(args.daemon_address)
+    if args.cancel:
+        return client.cancel(args.cancel)
+    if args.list:
+        return client.jobs()
+    if args.stop_daemon:
+        return client.shutdown()
+    if args.set_limits:
+        # 只修改命令行中给出的值
+        if args.bvid:
+            return client.update_job(args.bvid, weight=args.weight, rate=args.job_rate)
+        return client.set_limits(global_rate=args.rate_limit, host_rate=args.host_rate_limit)
+    return client.job(args.bvid) if args.bvid else client.status()
+
 def main():
     args = parse_args()
     
-    downloader = BLDownloader(
+    if args.weight is not None and args.weight <= 0:
+        sys.exit("--weight must be positive")
+    if args.status or args.list or args.cancel or args.stop_daemon or args.set_limits:
+        try:
+            print(json.dumps(client_command(args), ensure_ascii=False, indent=4))
+        except OSError as e:
+            sys.exit(f"Daemon not reachable at {args.daemon_address}: {e}")
+        except RuntimeError as e:
+            sys.exit(str(e))
+        return
+    downloader_kwargs = dict(
         max_workers=args.max_workers,
-        chunk_size=args.segment_size,
+        chunk_size=args.chunk_size,
+        memory_budget=args.memory_budget,
         timeout=args.timeout,
         retry=args.retry,
         ffmpeg_path=args.ffmpeg_path,
+        engine=args.engine,
+        adaptive=args.adaptive,
+        meta_cache=not args.no_meta_cache,
+        media_store=not args.no_media_store,
+        store_quota=args.store_quota,
+        http2=args.http2,
+        progress=args.progress,
+        stats_file=args.stats_file,
+        stats_interval=args.stats_interval,
+    )
+    rate_limits = dict(rate_limit=args.rate_limit or 0, host_rate_limit=args.host_rate_limit or 0)
+    job_limits = dict(weight=args.weight, rate=args.job_rate)
+    download_kwargs = dict(
+        use_segments=args.use_segments,
+        cache=args.cache,
+        direct_mux=args.direct_mux,
     )
+    # 任务接口不携带片段区间，指定 --start/--end 时在本进程下载
+    clip_requested = args.start is not None or args.end is not None
+    if not args.daemon and not args.no_daemon and not clip_requested and (args.bvid or args.batch):
+        # 有常驻进程时只提交任务并立即返回
+        client = BLClient(args.daemon_address)
+        try:
+            status = client.status()
+        except (OSError, RuntimeError, ValueError):
+            status = None
+        if status is not None:
+            warn_ignored_settings(status.get('settings') or {}, dict(download_path=os.path.abspath(args.download_path), **download_kwargs, **downloader_kwargs, **rate_limits))
+            bvids = read_bvids(args.batch) if args.batch else [args.bvid]
+            print(json.dumps(client.submit(bvids, **job_limits), ensure_ascii=False, indent=4))
+            return
+    
+    # 以下模块导入较慢，只在本进程需要下载时才导入
+    from bldownloader import BLDownloader
+    from bllimit import BLBandwidthLimiter
+    from bldash import parse_time
+    
+    if clip_requested:
+        try:
+            clip = (parse_time(args.start or 0), parse_time(args.end) if args.end is not None else None)
+        except ValueError as e:
+            sys.exit(f"Invalid --start/--end: {e}")
+        if clip[1] is not None and clip[1] <= clip[0]:
+            sys.exit("--end must be after --start")
+        download_kwargs['clip'] = clip
+    downloader = BLDownloader(**downloader_kwargs, limiter=BLBandwidthLimiter(rate_limits['rate_limit'], rate_limits['host_rate_limit']))
     downloader.login()
+    if args.daemon:
+        from bldaemon import BLDaemon
+        BLDaemon(downloader, args.queue_path, args.download_path, download_kwargs, args.daemon_address, settings=dict(downloader_kwargs, **rate_limits), jobs=args.daemon_jobs).serve()
+        return
+    if args.batch:
+        from blqueue import run_batch
+        # 只在父进程登录一次，工作进程读取导出的 cookie
+        counts = run_batch(
+            args.queue_path,
+            read_bvids(args.batch),
+            args.processes,
+            downloader_kwargs,
+            download_kwargs,
+            args.download_path,
+            max_attempts=args.max_attempts,
+            weight=args.weight,
+            job_rate=args.job_rate,
+            **rate_limits
+        )
+        downloader.logger.info(f"Batch finished: {counts}")
+        return
     downloader.download_bvid(
         args.bvid,
         save_path=args.download_path,
-        use_segments=args.use_segments,
-        cache=args.cache,
+        weight=args.weight or 1,
+        rate=args.job_rate or 0,
+        **download_kwargs
     )
 
-
 if __name__ == "__main__":
     main()
     
\ No newline at end of file